@@ -8,11 +8,21 @@
 
 import argparse
 import importlib
-import pathlib
-try:
-    import readline  # noqa F401 -- unused, but import automatically adds command history (via up/down keys)
-except ModuleNotFoundError:
-    pass  # that's okay; it's just an enhancement if it's present
+import os
+import sys
+
+from sim_coverage import Coverage
+
+# Architecture modules live in archs/ next to this file, wherever it's run from
+ARCHS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archs")
+
+
+def arch_names() -> list[str]:
+    """ Return the names of all architectures in ARCHS_DIR, without importing them. """
+    return sorted(
+        entry.name[:-3] for entry in os.scandir(ARCHS_DIR)
+        if entry.name.endswith(".py") and not entry.name.startswith("_")
+    )
 
 
 def read_cmd() -> tuple[str, list[str]]:
@@ -52,17 +62,206 @@ Commands:
                 Useful when debugging!  Run until a given instruction is reached.
     (R)eset  -- Reset the state of the CPU, clearing all memory elements except
                 the instruction memory.
+    Stats    -- Show runtime statistics: cycles simulated, instructions per
+                second over the last run, memory and I/O traffic, and time
+                spent simulating vs. printing (plus estimated hardware cycles,
+                CPI, and stalls if run with --timing, and memoized calls if
+                run with --memo).  Write "stats json" to get them as JSON
+                instead.
     (Q)uit   -- Exit the simulation.
 
-    Commands are case insensitive.""")
+    Commands are case insensitive.
+
+    The same commands can be run non-interactively from a file with the
+    --script option, one per line (with '#' comments).  Watch then runs
+    without displaying anything, and the state is only shown where the script
+    has a 'print' command.""")
+
+
+def save_coverage(sim, covfile: str) -> None:
+    """ Add the loaded program's coverage into covfile, along with any
+        earlier coverage of the same program there.  A coverage file holds
+        one program's coverage, so if covfile has a different program's, the
+        coverage goes into a file of its own next to it (named with the
+        program's ID) rather than replacing anything.
+    """
+    if not sim.bin_filename:
+        return  # no program was loaded, so there's nothing to save
+    coverage = sim.coverage
+    try:
+        earlier = _load_coverage(covfile)
+        if earlier is not None and earlier.program != coverage.program:
+            root, ext = os.path.splitext(covfile)
+            own_file = f"{root}.{coverage.program[:8]}{ext}"
+            print(f"[1;31m{covfile} holds coverage of a different program;[m using {own_file}")
+            covfile = own_file
+            earlier = _load_coverage(covfile)
+        if earlier is not None:
+            coverage.merge(earlier)
+        coverage.save(covfile)
+    except Exception as e:
+        print(f"[1;31mCoverage not saved:[m {e}")
+        return
+    summary = coverage.summary(sim.branch_addrs())
+    print(f"Coverage of {sim.bin_filename} saved to {covfile}: "
+          f"{summary['executed']}/{summary['instructions']} instructions executed, "
+          f"{summary['branches_both_ways']}/{summary['branches']} branches went both ways.")
+
 
+def _load_coverage(covfile: str) -> Coverage | None:
+    try:
+        return Coverage.load(covfile)
+    except FileNotFoundError:
+        return None
 
-def main() -> None:
+
+class CommandError(Exception):
+    """ A command that couldn't be carried out, with a message for the user. """
+    def __init__(self, headline: str, detail: str = "") -> None:
+        super().__init__(f"{headline} {detail}".strip())
+        self.headline = headline
+        self.detail = detail
+
+
+def do_command(sim, cmd: str, args: list[str], interactive: bool = True, covfile: str | None = None) -> bool:
+    """ Carry out one command (anything but Quit) on sim.
+
+    Parameters:
+     - cmd: the command word, uppercase
+     - args: any arguments written after it
+     - interactive: whether the user can be prompted for missing arguments
+                    and watches are displayed; in script mode, neither is
+     - covfile: the coverage file, if recording coverage, so the current
+                program's coverage can be saved before another is loaded
+
+    Returns whether the state of the simulation should be printed afterward.
+    Raises CommandError if the command can't be carried out.
+    """
+    def arg_or_prompt(prompt: str, missing: str) -> str:
+        if args:
+            return args[0]
+        if interactive:
+            return input(prompt)
+        raise CommandError(missing)
+
+    def int_arg(missing: str = "", default: int | None = None) -> int:
+        if not args:
+            if default is not None:
+                return default
+            raise CommandError(missing)
+        try:
+            return int(args[0])
+        except ValueError:
+            raise CommandError("Invalid number:", args[0])
+
+    # help doesn't print the state again, just goes straight to another prompt
+    if cmd[0] == 'H':
+        print_help()
+        return False
+
+    # neither does stats (checked before 'S', which is Step)
+    elif cmd == 'STATS':
+        if args and args[0].lower() == "json":
+            print(sim.stats_json())
+        else:
+            from print_utils import print_stats
+            print_stats(sim.stats(), "Statistics")
+        return False
+
+    # scripts only show the state where they ask for it
+    elif cmd == 'PRINT':
+        sim.print()
+        return False
+
+    elif cmd[0] == 'L':
+        filename = arg_or_prompt("[1;32mBinary file:[m ", "Load command requires a filename.  (E.g., 'L test.bin')")
+        if covfile is not None:
+            save_coverage(sim, covfile)  # loading replaces the coverage
+        try:
+            sim.load_bin(filename)
+        except Exception as e:
+            raise CommandError("Error loading file:", str(e))
+
+    elif cmd[0] == 'B':
+        num_buttons = sim.NUMBUTTONS
+        example = f"{1:0{num_buttons}x}"
+        buttons = arg_or_prompt(
+            f"[1;32mNew state[0;32m ({num_buttons} buttons; 0 or 1 each; e.g. '{example}' to press just the last button)[1;32m:[m ",
+            f"Button command requires a new state.  (E.g., 'B {example}')"
+        )
+        try:
+            sim.change_buttons(buttons)
+        except Exception as e:
+            raise CommandError("Invalid button string:", str(e))
+
+    elif cmd[0] == 'S':
+        n = int_arg(default=1)
+        sim.step_n(n)
+
+    elif cmd[0] == 'W':
+        n = int_arg("Watch command requires a number of cycles to watch.  (E.g., 'W 10000')")
+        if interactive:
+            sim.watch_n(n)
+        else:
+            sim.step_n(n)
+
+    elif cmd[0] == 'U':
+        tgt = int_arg("Run Until command requires a target PC value.  (E.g., 'U 12')")
+        sim.run_until(tgt)
+
+    elif cmd[0] == 'R':
+        sim.reset()
+
+    elif not interactive:
+        raise CommandError("Unknown command:", cmd)
+
+    return interactive
+
+
+def run_script(sim, lines: list[str], name: str, covfile: str | None = None) -> int:
+    """ Run REPL commands from a script, one per line, without showing the
+        state except at 'print' commands.  Blank lines and '#' comments are
+        ignored, and 'Q' ends the script early.
+
+    Returns an exit status: 0 if every command succeeded, or 1 if any failed
+    (in which case the rest of the script is skipped).
+    """
+    for lineno, line in enumerate(lines, start=1):
+        parts = line.split("#")[0].split()
+        if not parts:
+            continue
+        cmd, args = parts[0].upper(), parts[1:]
+        if cmd[0] == 'Q':
+            break
+        try:
+            do_command(sim, cmd, args, interactive=False, covfile=covfile)
+        except Exception as e:
+            # CommandErrors and anything raised by the simulation itself
+            print(f"[1;31m{name}:{lineno}:[m {line.strip()}: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def main() -> int:
     parser = argparse.ArgumentParser(description="Simulate a CS256-designed CPU.")
-    # Find all files archs/*.py, strip the .py part
-    archs = [p.name[:-3] for p in pathlib.Path(".").glob("archs/*.py")]
-    parser.add_argument("architecture", choices=archs)
+    parser.add_argument("architecture", choices=arch_names())
     parser.add_argument("binfile", nargs="?")
+    parser.add_argument("--coverage", metavar="COVFILE",
+                        help="record instruction/branch coverage, adding it to COVFILE (see sim_coverage.py); "
+                             "coverage of any other program loaded goes next to it, in COVFILE with the program's ID added")
+    parser.add_argument("--timing", action="store_true",
+                        help="estimate clock cycles on the real hardware, reported by the stats command")
+    parser.add_argument("--no-fast-loops", action="store_true",
+                        help="execute counted delay loops one instruction at a time (see delay_loops.py)")
+    parser.add_argument("--memo", action="store_true",
+                        help="replay subroutine calls already made with the same inputs instead of executing them "
+                             "(see call_memo.py)")
+    parser.add_argument("--render-process", type=int, nargs="?", const=20, metavar="FPS",
+                        help="when watching, draw the state from a separate process at up to FPS "
+                             "frames per second (default: 20), so the display can't slow down the simulation")
+    parser.add_argument("--script", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) without showing the state "
+                             "except at 'print' commands, then exit")
     cmdline_args = parser.parse_args()
 
     arch = importlib.import_module(f"archs.{cmdline_args.architecture}")
@@ -76,8 +275,36 @@ def main() -> None:
             sim.load_bin(cmdline_args.binfile)
         except Exception as e:
             print(f"[1;31mError loading file:[m {e}")
-            return
+            return 1
+
+    if cmdline_args.coverage:
+        sim.enable_coverage()  # each program loaded gets a new Coverage, merged into covfile when saved
+    if cmdline_args.timing:
+        sim.enable_timing()
+    if cmdline_args.no_fast_loops:
+        sim.set_fast_loops(False)
+    if cmdline_args.memo:
+        sim.enable_memo()
+    if cmdline_args.render_process:
+        sim.render_fps = cmdline_args.render_process
 
+    if cmdline_args.script:
+        if cmdline_args.script == "-":
+            status = run_script(sim, sys.stdin.readlines(), "<stdin>", cmdline_args.coverage)
+        else:
+            with open(cmdline_args.script, "r") as f:
+                status = run_script(sim, f.readlines(), cmdline_args.script, cmdline_args.coverage)
+        if sim.coverage is not None:
+            save_coverage(sim, cmdline_args.coverage)
+        return status
+
+    # Everything from here on is an interactive session
+    try:
+        import readline  # noqa F401 -- unused, but import automatically adds command history (via up/down keys)
+    except ModuleNotFoundError:
+        pass  # that's okay; it's just an enhancement if it's present
+
+    if cmdline_args.binfile:
         # Print state once to start if code already loaded
         sim.print()
 
@@ -90,55 +317,22 @@ def main() -> None:
     while True:
         cmd, args = read_cmd()
 
-        # help doesn't print the state again, just goes straight to another prompt
-        if cmd[0] == 'H':
-            print_help()
-            continue
-
-        elif cmd[0] == 'L':
-            filename = args[0] if args else input("[1;32mBinary file:[m ")
-            try:
-                sim.load_bin(filename)
-            except Exception as e:
-                print(f"[1;31mError loading file:[m {e}")
-                continue
-
-        elif cmd[0] == 'B':
-            num_buttons = arch._NUMBUTTONS  # ideally would be a method of the Simulator class...
-            example = f"{1:0{num_buttons}x}"
-            buttons = args[0] if args else input(f"[1;32mNew state[0;32m ({num_buttons} buttons; 0 or 1 each; e.g. '{example}' to press just the last button)[1;32m:[m ")
-            try:
-                sim.change_buttons(buttons)
-            except Exception as e:
-                print(f"[1;31mInvalid button string:[m {e}")
-                continue
-
-        elif cmd[0] == 'S':
-            n = int(args[0]) if args else 1
-            sim.step_n(n)
-
-        elif cmd[0] == 'W':
-            if not args:
-                print("[1;31mWatch command requires a number of cycles to watch.  (E.g., 'W 10000'[m")
-                continue
-            n = int(args[0])
-            sim.watch_n(n)
-
-        elif cmd[0] == 'U':
-            if not args:
-                print("[1;31mRun Until command requires a target PC value.  (E.g., 'U 12'[m")
-                continue
-            tgt = int(args[0])
-            sim.run_until(tgt)
+        if cmd[0] == 'Q':
+            break
 
-        elif cmd[0] == 'R':
-            sim.reset()
+        try:
+            show_state = do_command(sim, cmd, args, covfile=cmdline_args.coverage)
+        except CommandError as e:
+            print(f"[1;31m{e.headline}[m {e.detail}")
+            continue
 
-        elif cmd[0] == 'Q':
-            break
+        if show_state:
+            sim.print()
 
-        sim.print()
+    if sim.coverage is not None:
+        save_coverage(sim, cmdline_args.coverage)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
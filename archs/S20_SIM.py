@@ -3,294 +3,262 @@
 #
 # Authors: Mark Liffiton, Jonathan Nocek, Kyle Wheat
 #
-from print_utils import print_val, print_mem, print_input, print_matrix
+from memory_bus import MemoryBus, matrix_writer
+from simulator_base import BaseSimulator
+from timing import TimingModel
 
 import random
-import time
-
-# Constants for this architecture
-_NUMREG = 8  # number of registers in the register file
-_REGSIZE = 8  # size (in bits) of each register)
-_ADDRSIZE = _REGSIZE  # size (in bits) of DMEM addresses
-_NUMBUTTONS = 4  # Number of buttons (binary on/off) for input
-_MATRIXSIZE = 10  # width and height of the pixel matrix output
-
-
-class Simulator:
-    def __init__(self):
-        # CPU state:
-        self.imem = [0]  # not affected by CPU reset, so only initialized here
-        self.reset()
-
-        # Simulator state (separate from the CPU itself):
-        self.bin_filename = ""
-
-    def load_bin(self, filename):
-        # Load machine code from a file into instruction memory
-        self.bin_filename = filename
-        with open(filename, "r") as f:
-            data = f.read()
-        words = data.split()
-        self.imem = [int(word, 16) for word in words]
-
-        # Always reset on loading new code
-        self.reset()
-
-    def change_buttons(self, new_buttons):
-        # Change the state of the simulated buttons
-        # Parameter: new_buttons is a string, containing a 0 or 1 for each button
-        #            e.g. "0110" for the first button not pressed, the second and
-        #            third pressed, and the fourth not pressed.
-        buttons = [int(c) for c in new_buttons]
-        if len(buttons) != _NUMBUTTONS:
-            raise Exception(
-                f"Incorrect number of buttons.  Got {len(buttons)}, expected {_NUMBUTTONS}."
-            )
-        if max(buttons) > 1 or min(self.buttons) < 0:
-            raise Exception(
-                f"Invalid value for button.  Only allowed values are 0 and 1."
-            )
-        self.buttons = buttons
-
-    def step_n(self, n):
-        # Simulate n cycles of the CPU (see self.step()).
-        for _ in range(n):
-            self.step()
-
-    def watch_n(self, n):
-        # Simulate n cycles of the CPU, as in step_n(), but watch the
-        # state of the CPU by printing after every 100th cycle.
-        for i in range(n):
-            self.step()
-            if i % 100 == 0:
-                print("[2J[H")  # clear the screen and return to home position
-                self.print()
-                time.sleep(0.05)
-
-    def step(self):
-        # Simulate *one* cycle of the CPU (Fetch-Decode-Execute)
-        # Basic outline:
-        #  1) Fetch the current instruction (using imem and PC)
-        #  2) Decode the instruction into its different fields
-        #  3) Execute the instruction by updating the CPU state
-        #     according to what the execution of that instruction
-        #     would do.
-        word = self.fetch()
-        op, r1, r2, imm, func = self.decode(word)
-        self.execute(op, r1, r2, imm, func)
 
-    def reset(self):
-        # Reset the CPU state to just-powered-on, with everything but IMEM cleared
-        self.PC = 0
-        self.regfile = [0] * _NUMREG
-        self.dmem = [0] * 2 ** _ADDRSIZE
-        self.buttons = [0] * _NUMBUTTONS
-        self.matrix = [([0] * _MATRIXSIZE) for _ in range(_MATRIXSIZE)]
-
-    def print(self):
-        # Print the current state of all state (memory) elements of the CPU
-        print_val(self.PC, "PC")
-        print_mem(self.imem, "IMEM", val_width=16, highlight=self.PC)
-        print_mem(self.regfile, "Regfile", label_all=True)
-        print_mem(self.dmem, "DMEM", limit_to_modified=True)
-        print_input(self.buttons, "Input")
-        print_matrix(self.matrix, "Output")
-
-    def fetch(self):
-        """Fetch word in imem using the program counter, then increment PC
+# Mnemonics for R-type instructions (opcode 0), indexed by func
+_RTYPE = {0: "add", 1: "sub", 2: "load", 3: "store", 4: "in", 5: "out", 6: "sgt"}
+# Mnemonics for I-type instructions, indexed by opcode
+_ITYPE = {1: "addi", 2: "assigni", 3: "beq", 4: "bne", 5: "rand"}
+_FUNCS = {mnemonic: func for func, mnemonic in _RTYPE.items()}
+_OPCODES = {mnemonic: opcode for opcode, mnemonic in _ITYPE.items()}
+
+# Registers random_instruction() never writes at random: $6 always holds a
+# DMEM address for load and store, and $5 an LED port for out
+_FREE_REGS = (0, 1, 2, 3, 4, 7)
+
+
+class Simulator(BaseSimulator):
+    NUMREG = 8  # number of registers in the register file
+    REGSIZE = 8  # size (in bits) of each register)
+    ADDRSIZE = REGSIZE  # size (in bits) of DMEM addresses
+    NUMBUTTONS = 4  # Number of buttons (binary on/off) for input
+    MATRIXSIZE = 10  # width and height of the pixel matrix output
+    BRANCH_OPS = frozenset({"beq", "bne"})
+    RANDOM_OPS = frozenset({"rand"})
+    # Hardware timing (for enable_timing()): memory and I/O take two clock
+    # cycles, and a taken branch costs one more to refetch.
+    TIMING = TimingModel(
+        latencies={"load": 2, "store": 2, "in": 2, "out": 2},
+        taken_penalty=1,
+        load_ops={"load", "in"},
+        load_use_penalty=1,
+    )
 
-        Returns:
-            word -- Fetched word from imem
-        """
-        word = self.imem[self.PC]
-        self.PC += 1
-        return word
+    def reset(self):
+        super().reset()
+        # I/O is port-mapped, using a separate address space reached only by
+        # in and out: buttons are input ports, LEDs are output ports.
+        self.ports = MemoryBus(self.REGSIZE)
+        self.ports.map(0, self.NUMBUTTONS, read=self.buttons.__getitem__, name="buttons")
+        self.ports.map(0, self.MATRIXSIZE**2, write=matrix_writer(self.matrix), name="matrix")
 
     def decode(self, word):
         """Decode word and parse to components of R-type and I-Type instuctions
 
         Arguments:
-            word -- Gathered via fetch()
+            word -- Machine code word from imem
 
         Returns:
-            opcode -- Both I-Type and R-Type
+            mnemonic -- Instruction name (None if the word is not an instruction)
             r1 -- Both I-Type and R-Type
-            r2 -- Only for R-Type, None for I-Type
-            imm -- Only for I-Type, None for R-Type
-            func -- Only for R-Type, None for I-Type
+            r2 / imm -- r2 for R-Type, immediate for I-Type
         """
         opcode_mask = 0b111 << 13
         opcode = (word & opcode_mask) >> 13
+
+        r1_mask = 0b111 << 10
+        r1 = (word & r1_mask) >> 10
+
         # If opcode is 0, parse word for R-type instruction
         if opcode == 0:
-            r1_mask = 0b111 << 10
-            r1 = (word & r1_mask) >> 10
-
             r2_mask = 0b111 << 7
             r2 = (word & r2_mask) >> 7
 
             func_mask = 0b1111111
             func = word & func_mask
-            imm = None
-            return opcode, r1, r2, imm, func
+            return _RTYPE.get(func), r1, r2
 
         # If opcode is not 0, parse word for I-type instruction
         else:
-            r1_mask = 0b111 << 10
-            r1 = (word & r1_mask) >> 10
-
             immediate_mask = 0b1111111111
             imm = word & immediate_mask
-            r2 = None
-            func = None
-            return opcode, r1, r2, imm, func
-
-    def execute(self, op, r1, r2, imm, func):
-        """Execute instruction
-
-        Arguments:
-            op -- Opcode Code
-            r1 -- Register 1
-            r2 -- Register 2
-            imm -- Immediate Value
-            func -- Function code
-        """
-        if op == 0:
-            if func == 0:
-                self._add(r1, r2)
-            if func == 1:
-                self._sub(r1, r2)
-            if func == 2:
-                self._load(r1, r2)
-            if func == 3:
-                self._store(r1, r2)
-            if func == 4:
-                self._in(r1, r2)
-            if func == 5:
-                self._out(r1, r2)
-            if func == 6:
-                self._sgt(r1, r2)
-
-        else:
-            if op == 1:
-                self._addi(r1, imm)
-            if op == 2:
-                self._assigni(r1, imm)
-            if op == 3:
-                self._beq(r1, imm)
-            if op == 4:
-                self._bne(r1, imm)
-            if op == 5:
-                self._rand(r1, imm)
-
-    def _add(self, r1, r2):
-        """
-        r1 = r1 + r2
-        R-format
-        """
-        self.regfile[r1] += self.regfile[r2]
-
-    def _addi(self, r1, imm):
-        """
-        r1 = r1 + imm
-        I-format
-        """
-        # correct for negative immediates (not parsed as negative so far)
-        if imm > 0b111111111:
-            imm -= 1024
-        self.regfile[r1] += imm
-
-    def _assigni(self, r1, imm):
-        """
-        r1 = imm
-        I-format
-        """
-        # correct for negative immediates (not parsed as negative so far)
-        if imm > 0b111111111:
-            imm -= 1024
-        self.regfile[r1] = imm
-
-    def _sub(self, r1, r2):
-        """
-        r1 = r1 - r2
-        R-format
-        """
-        self.regfile[r1] -= self.regfile[r2]
-
-    def _load(self, r1, r2):
-        """
-        r1 = Mem[r2]
-        R-format
-        """
-        self.regfile[r1] = self.dmem[self.regfile[r2]]
-
-    def _store(self, r1, r2):
-        """
-        Mem[r2] = r1
-        R-format
-        """
-        self.dmem[self.regfile[r2]] = self.regfile[r1]
-
-    def _beq(self, r1, label):
-        """
-        If (r1 == $7) goto label [implicitly, $7 is always used in the comparison]
-        I-format
-        """
-        if self.regfile[r1] == self.regfile[7]:
-            # correct for negative immediates (not parsed as negative so far)
-            if label > 0b111111111:
-                label -= 1024
-            self.PC += label
-            # correct for automatic PC += 1
-            self.PC -= 1
-        else:
-            pass
-
-    def _bne(self, r1, label):
-        """
-        If (r1 != $7) goto label [implicitly, $7 is always used in the comparison]
-        I-format
-        """
-        if self.regfile[r1] != self.regfile[7]:
-            # correct for negative immediates (not parsed as negative so far)
-            if label > 0b111111111:
-                label -= 1024
-            self.PC += label
-            # correct for automatic PC += 1
-            self.PC -= 1
-        else:
-            pass
-
-    def _sgt(self, r1, r2):
-        """
-        $7 = (r1 > r2) ? 1 : 0 [implicitly, $7 is always used in the comparison]
-        R-format
-        """
-        if self.regfile[r1] > self.regfile[r2]:
-            self.regfile[7] = 1
-        else:
-            self.regfile[7] = 0
-
-    def _in(self, r1, r2):
-        """
-        r1 = IO[r2]
-        R-format
-        """
-        self.regfile[r1] = self.buttons[r2]
-
-    def _out(self, r1, r2):
-        """
-        IO[r2] = r1
-        R-format
-        """
-        x = self.regfile[r2] % _MATRIXSIZE
-        y = self.regfile[r2] // _MATRIXSIZE
-        self.matrix[y][x] = self.regfile[r1]
-
-    def _rand(self, r1, imm):
-        """
-        r1 = [randvalue] & imm    [randvalue is a random 8-bit value]
-        I-format
-        """
-        randvalue = random.getrandbits(8)
-        self.regfile[r1] = randvalue & imm
+            mnemonic = _ITYPE.get(opcode)
+            # rand masks with the raw immediate; everything else treats it as
+            # a signed value (not parsed as negative so far)
+            if mnemonic != "rand" and imm > 0b111111111:
+                imm -= 1024
+            return mnemonic, r1, imm
+
+    def encode(self, instr):
+        op, r1, b = instr
+        if op in _FUNCS:
+            return (r1 << 10) | (b << 7) | _FUNCS[op]
+        if op in _OPCODES:
+            return (_OPCODES[op] << 13) | (r1 << 10) | (b & 0b1111111111)
+        raise ValueError(f"Cannot encode {instr}.")
+
+    def reg_access(self, instr):
+        op, r1, r2 = instr
+        if op in ("add", "sub"):
+            return (r1, r2), (r1,)
+        if op == "load":
+            return (r2,), (r1,)
+        if op == "addi":
+            return (r1,), (r1,)
+        if op in ("store", "out"):
+            return (r1, r2), ()
+        if op in ("in", "assigni", "rand"):
+            return (), (r1,)
+        if op == "sgt":
+            return (r1, r2), (7,)
+        if op in self.BRANCH_OPS:
+            return (r1, 7), ()
+        return (), ()
+
+    def counter_update(self, instr):
+        op, r1, b = instr
+        if op == "addi":
+            return r1, b, None, 0
+        if op in ("add", "sub"):
+            return r1, 0, b, 1 if op == "add" else -1
+        return None
+
+    def branch_condition(self, instr):
+        op, r1, _ = instr
+        if op in self.BRANCH_OPS:
+            return r1, "==" if op == "beq" else "!=", 7
+        return None
+
+    def jump_target(self, addr, instr):
+        op, _, label = instr
+        if op in self.BRANCH_OPS:
+            return addr + label
+        return None
+
+    def disassemble(self, addr, instr):
+        op, r1, b = instr
+        if op is None:
+            return super().disassemble(addr, instr)
+        if op in _RTYPE.values():
+            return f"{op} ${r1} ${b}"
+        if op in self.BRANCH_OPS:
+            return f"{op} ${r1} {b:+d}  -> {addr + b:02x}"
+        return f"{op} ${r1} {b}"
+
+    def random_instruction(self, op, rng, addr, length, footprint):
+        if op in ("add", "sub", "sgt"):
+            return op, rng.choice(_FREE_REGS), rng.randrange(self.NUMREG)
+        if op == "load":
+            return op, rng.choice(_FREE_REGS), 6
+        if op == "store":
+            return op, rng.randrange(self.NUMREG), 6
+        if op == "in":
+            return op, rng.choice(_FREE_REGS), rng.randrange(self.NUMBUTTONS)
+        if op == "out":
+            return op, rng.randrange(self.NUMREG), 5
+        if op == "addi":
+            return op, rng.choice(_FREE_REGS), rng.randint(-512, 511)
+        if op == "assigni":
+            choice = rng.randrange(4)
+            if choice == 0:
+                return op, 6, rng.randrange(min(footprint, len(self.dmem)))
+            if choice == 1:
+                return op, 5, rng.randrange(self.MATRIXSIZE**2)
+            return op, rng.choice(_FREE_REGS), rng.randint(-512, 511)
+        if op in self.BRANCH_OPS:
+            targets = [t for t in range(max(addr - 512, 0), min(addr + 512, length)) if t != addr]
+            return op, rng.randrange(self.NUMREG), rng.choice(targets) - addr
+        if op == "rand":
+            return op, rng.choice(_FREE_REGS), rng.randrange(1024)
+        return super().random_instruction(op, rng, addr, length, footprint)
+
+    def jump_to_start(self, addr):
+        if addr > 512:
+            raise ValueError("Branches can only reach 512 instructions back, so programs can be at most 513 long.")
+        # $7 always equals itself
+        return "beq", 7, -addr
+
+    def _make_handlers(self):
+        regfile = self.regfile
+        page_bits = self.bus.page_bits
+        mem_read = self.bus.readers
+        mem_write = self.bus.writers
+        mem_count = self.bus.accesses
+        port_bits = self.ports.page_bits
+        port_read = self.ports.readers
+        port_write = self.ports.writers
+        port_count = self.ports.accesses
+
+        def _add(pc, r1, r2):
+            # r1 = r1 + r2
+            regfile[r1] += regfile[r2]
+            return pc
+
+        def _sub(pc, r1, r2):
+            # r1 = r1 - r2
+            regfile[r1] -= regfile[r2]
+            return pc
+
+        def _load(pc, r1, r2):
+            # r1 = Mem[r2]
+            addr = regfile[r2]
+            mem_count[0] += 1
+            regfile[r1] = mem_read[addr >> page_bits](addr)
+            return pc
+
+        def _store(pc, r1, r2):
+            # Mem[r2] = r1
+            addr = regfile[r2]
+            mem_count[1] += 1
+            mem_write[addr >> page_bits](addr, regfile[r1])
+            return pc
+
+        def _in(pc, r1, r2):
+            # r1 = IO[r2]  [the port number is r2 itself, not its contents]
+            port_count[0] += 1
+            regfile[r1] = port_read[r2 >> port_bits](r2)
+            return pc
+
+        def _out(pc, r1, r2):
+            # IO[r2] = r1
+            port = regfile[r2]
+            port_count[1] += 1
+            port_write[port >> port_bits](port, regfile[r1])
+            return pc
+
+        def _sgt(pc, r1, r2):
+            # $7 = (r1 > r2) ? 1 : 0 [implicitly, $7 is always used in the comparison]
+            regfile[7] = 1 if regfile[r1] > regfile[r2] else 0
+            return pc
+
+        def _addi(pc, r1, imm):
+            # r1 = r1 + imm
+            regfile[r1] += imm
+            return pc
+
+        def _assigni(pc, r1, imm):
+            # r1 = imm
+            regfile[r1] = imm
+            return pc
+
+        def _beq(pc, r1, label):
+            # If (r1 == $7) goto label [implicitly, $7 is always used in the comparison]
+            # (- 1 corrects for the automatic PC += 1)
+            if regfile[r1] == regfile[7]:
+                return pc + label - 1
+            return pc
+
+        def _bne(pc, r1, label):
+            # If (r1 != $7) goto label [implicitly, $7 is always used in the comparison]
+            if regfile[r1] != regfile[7]:
+                return pc + label - 1
+            return pc
+
+        def _rand(pc, r1, imm):
+            # r1 = [randvalue] & imm    [randvalue is a random 8-bit value]
+            regfile[r1] = random.getrandbits(8) & imm
+            return pc
+
+        def _nop(pc, a, b):
+            return pc
+
+        return {
+            "add": _add, "sub": _sub, "load": _load, "store": _store,
+            "in": _in, "out": _out, "sgt": _sgt,
+            "addi": _addi, "assigni": _assigni, "beq": _beq, "bne": _bne,
+            "rand": _rand, None: _nop,
+        }
@@ -1,272 +1,298 @@
-#
-# s21-ApplePi.py  --  Simulator class for ApplePi.
-#
-# Authors: Ray Loerke, Mark Liffiton
-#
-from print_utils import print_val, print_mem, print_input, print_matrix
-
-import random
-import time
-
-# Constants for this architecture
-_NUMREG = 16      # number of registers in the register file
-_REGSIZE = 16     # size (in bits) of each register)
-_ADDRSIZE = 16    # size (in bits) of DMEM addresses
-_NUMBUTTONS = 4   # Number of buttons (binary on/off) for input
-_MATRIXSIZE = 10  # width and height of the pixel matrix output
-
-
-class Simulator:
-    def __init__(self):
-        # CPU state:
-        self.imem = [0]  # not affected by CPU reset, so only initialized here
-        self.reset()
-
-        # Simulator state (separate from the CPU itself):
-        self.bin_filename = ""
-
-    def load_bin(self, filename):
-        # Load machine code from a file into instruction memory
-        self.bin_filename = filename
-        with open(filename, "r") as f:
-            data = f.read()
-        words = data.split()
-        self.imem = [int(word, 16) for word in words]
-
-        # Always reset on loading new code
-        self.reset()
-
-    def change_buttons(self, new_buttons):
-        # Change the state of the simulated buttons
-        # Parameter: new_buttons is a string, containing a 0 or 1 for each button
-        #            e.g. "0110" for the first button not pressed, the second and
-        #            third pressed, and the fourth not pressed.
-        buttonvals = [int(c) for c in new_buttons]
-        if len(buttonvals) != _NUMBUTTONS:
-            raise Exception(
-                f"Incorrect number of buttons.  Got {len(buttonvals)}, expected {_NUMBUTTONS}."
-            )
-        if max(buttonvals) > 1 or min(buttonvals) < 0:
-            raise Exception(
-                f"Invalid value for button.  Only allowed values are 0 and 1."
-            )
-        self.buttons = buttonvals
-
-    def step_n(self, n):
-        # Simulate n cycles of the CPU (see self.step()).
-        for _ in range(n):
-            self.step()
-
-    def watch_n(self, n):
-        # Simulate n cycles of the CPU, as in step_n(), but watch the
-        # state of the CPU by printing after every 100th cycle.
-        for i in range(n):
-            self.step()
-            if i % 100 == 0:
-                print("[2J[H")  # clear the screen and return to home position
-                self.print()
-                time.sleep(0.05)
-
-    def reset(self):
-        # Reset the CPU state to just-powered-on, with everything but IMEM cleared
-        self.PC = 0
-        self.regfile = [0] * _NUMREG
-        self.dmem = [0] * 2 ** _ADDRSIZE
-        self.buttons = [0] * _NUMBUTTONS
-        self.matrix = [([0] * _MATRIXSIZE) for _ in range(_MATRIXSIZE)]
-        # Setting up the one register
-        self.regfile[1] = 1
-
-    def print(self):
-        # Print the current state of all state (memory) elements of the CPU
-        print_val(self.PC, "PC")
-        print_mem(self.imem, "IMEM", val_width=16, highlight=self.PC)
-        print_mem(self.regfile, "Regfile", val_width=16, label_all=True)
-        print_mem(self.dmem, "DMEM", val_width=16, min_addr=0x100, limit_to_modified=True)
-        print_input(self.buttons, "Input")
-        print_matrix(self.matrix, "Output")
-
-    def step(self):
-        # Simulate *one* cycle of the CPU (Fetch-Decode-Execute)
-        # Basic outline:
-        #  1) Fetch the current instruction (using imem and PC)
-        #  2) Decode the instruction into its different fields
-        #  3) Execute the instruction by updating the CPU state
-        #     according to what the execution of that instruction
-        #     would do.
-
-        instruction = self.imem[self.PC]
-        # PC is incremented after the instruction is fetched
-        self.PC += 1
-
-        op, reg1, reg2, imm, tgt = self.decode(instruction)
-        self.execute(op, reg1, reg2, imm, tgt)
-
-    def decode(self, instruction):
-        # The instruction passed to the function is separated into its various fields based on the instruction type
-        # These are the op codes sorted into their instruction types
-        # R-Format = 0, 1, 3, 4, 6, 9
-        # I-Format = 2, 7, 8, 10
-        # J-Format = 5
-        op_mask = (0b1111 << 12)
-        op = (instruction & op_mask) >> 12
-
-        if op == 5:
-            # For J-Format instructions only the op code and target need to be extracted
-            tgt_mask = 0b111111111111
-            tgt = instruction & tgt_mask
-            # Fields not relevant to the instruction type are set to None
-            reg1 = None
-            reg2 = None
-            imm = None
-            # And each field of the instruction is returned
-            return op, reg1, reg2, imm, tgt
-
-        elif (op == 2) or (op == 7) or (op == 8) or (op == 10):
-            # For I-Format instructions the op code, register 1, and immediate fields need to be extracted
-            reg_mask = (0b1111 << 8)
-            reg1 = (instruction & reg_mask) >> 8
-            imm_mask = 0b11111111
-            imm = instruction & imm_mask
-            reg2 = None
-            tgt = None
-            return op, reg1, reg2, imm, tgt
-
-        else:
-            # For R-Format instructions the op code, register 1, and register 2 fields are extracted
-            reg1_mask = (0b1111 << 8)
-            reg2_mask = (0b1111 << 4)
-            reg1 = (instruction & reg1_mask) >> 8
-            reg2 = (instruction & reg2_mask) >> 4
-            imm = None
-            tgt = None
-            return op, reg1, reg2, imm, tgt
-
-    def execute(self, op, reg1, reg2, imm, tgt):
-        # This function calls the function corresponding to the instruction
-        # and passes in the values for the relevant fields
-        if op == 0:
-            self.add(reg1, reg2)
-        if op == 1:
-            self.sub(reg1, reg2)
-        if op == 2:
-            self.rand(reg1, imm)
-        if op == 3:
-            self.load(reg1, reg2)
-        if op == 4:
-            self.store(reg2, reg1)
-        if op == 5:
-            self.jal(tgt)
-        if op == 6:
-            self.jr(reg1)
-        if op == 7:
-            self.beq(reg1, imm)
-        if op == 8:
-            self.bgt(reg1, imm)
-        if op == 9:
-            self.set(reg1, reg2)
-        if op == 10:
-            self.seti(reg1, imm)
-
-    def setreg(self, reg, data):
-        # don't allow writes into registers $0 ($zero) and $1 ($one)
-        if reg == 0 or reg == 1:
-            return
-
-        # constrain data to 16 bits (a bit hacky to do it here, but oh well)
-        data = data & 0xffff
-
-        self.regfile[reg] = data
-
-    def add(self, reg1, reg2):
-        # reg1 = reg1 + reg2
-        result = self.regfile[reg1] + self.regfile[reg2]
-        self.setreg(reg1, result)
-
-    def sub(self, reg1, reg2):
-        # reg1 = reg1 - reg 2
-        result = self.regfile[reg1] - self.regfile[reg2]
-        self.setreg(reg1, result)
-
-    def seti(self, reg1, imm):
-        # reg1 = immediate
-        # If the most significant bit of the immediate is a 1
-        # then the immediate is negative and must be adjusted accordingly
-        if imm > 0b1111111:
-            imm -= 256
-        self.setreg(reg1, imm)
-
-    def set(self, reg1, reg2):
-        # reg1 = reg2
-        self.setreg(reg1, self.regfile[reg2])
-
-    def jr(self, reg1):
-        # PC = address in reg1
-        self.PC = self.regfile[reg1]
-
-    def jal(self, tgt):
-        # Current PC is stored in $15
-        # PC = Immediate (target)
-        self.regfile[15] = self.PC
-        self.PC = tgt
-
-    def load(self, reg1, reg2):
-        addr = self.regfile[reg2]
-        # If the address is <256, it is I/O
-        # If the address is <256, it is I/O
-        if addr < 0x100:
-            # Only current input device: buttons
-            if addr < _NUMBUTTONS:
-                data = self.buttons[addr]
-            else:
-                raise Exception(
-                        f"Invalid input address: {addr}  (valid input addresses: 0-{_NUMBUTTONS-1})"
-                )
-        else:
-            # data = Value in Data Memory at address reg2
-            data = self.dmem[self.regfile[reg2]]
-        # reg1 gets data read from I/O or DMEM
-        self.setreg(reg1, data)
-
-    def store(self, reg2, reg1):
-        addr = self.regfile[reg2]
-        data = self.regfile[reg1]
-        # If the address is <256, it is I/O
-        if addr < 0x100:
-            # Only current output device: LED matrix
-            if addr < _MATRIXSIZE**2:
-                # we need to update the LED display
-                self.matrix[addr // 10][addr % 10] = data
-        else:
-            # Data Memory at address reg2 = Value of reg1
-            self.dmem[addr] = data
-
-    def beq(self, reg1, imm):
-        # if reg1 == implicit register, jump to PC + immediate
-        if self.regfile[reg1] == self.regfile[15]:
-            # If the most significant bit of the immediate is a 1
-            # then the immediate is negative and must be adjusted accordingly
-            if imm > 0b1111111:
-                imm -= 256
-            self.PC += imm
-            # Subtract 1 from PC to counteract our addition in the step function
-            self.PC -= 1
-        else:
-            pass
-
-    def bgt(self, reg1, imm):
-        # if reg1 > implicit register, jump to PC + immediate
-        if self.regfile[reg1] > self.regfile[15]:
-            # If the most significant bit of the immediate is a 1
-            # then the immediate is negative and must be adjusted accordingly
-            if imm > 0b1111111:
-                imm -= 256
-            self.PC += imm
-            # Subtract 1 from PC to counteract our addition in the step function
-            self.PC -= 1
-        else:
-            pass
-
-    def rand(self, reg1, imm):
-        # reg1 = random value from 0-immediate
-        self.setreg(reg1, random.randint(0, imm))
+#
+# s21-ApplePi.py  --  Simulator class for ApplePi.
+#
+# Authors: Ray Loerke, Mark Liffiton
+#
+from memory_bus import MemoryBus, ignore_write, matrix_writer
+from simulator_base import BaseSimulator
+from timing import TimingModel
+
+import random
+
+# Mnemonics indexed by op code
+_OPS = {
+    0: "add", 1: "sub", 2: "rand", 3: "load", 4: "store", 5: "jal",
+    6: "jr", 7: "beq", 8: "bgt", 9: "set", 10: "seti",
+}
+
+_OPCODES = {mnemonic: op for op, mnemonic in _OPS.items()}
+
+# Registers with names in the assembly language
+_REGNAMES = {0: "$zero", 1: "$one"}
+
+# Registers random_instruction() never writes at random: $14 always holds an
+# address that can be loaded from, $13 one that can be stored to, and $12 an
+# instruction address for jr
+_FREE_REGS = (2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 15)
+
+
+def _reg(num):
+    return _REGNAMES.get(num, f"${num}")
+
+
+class Simulator(BaseSimulator):
+    NUMREG = 16      # number of registers in the register file
+    REGSIZE = 16     # size (in bits) of each register)
+    ADDRSIZE = 16    # size (in bits) of DMEM addresses
+    NUMBUTTONS = 4   # Number of buttons (binary on/off) for input
+    MATRIXSIZE = 10  # width and height of the pixel matrix output
+    BRANCH_OPS = frozenset({"beq", "bgt"})
+    CALL_OPS = frozenset({"jal"})
+    RANDOM_OPS = frozenset({"rand"})
+    # Hardware timing (for enable_timing()): loads and stores take two clock
+    # cycles, and taken branches and jumps cost one more to refetch.
+    TIMING = TimingModel(
+        latencies={"load": 2, "store": 2},
+        taken_penalty=1,
+        load_ops={"load"},
+        load_use_penalty=1,
+    )
+    DMEM_START = 0x100  # addresses below this are I/O
+    REG_MODULUS = 2 ** REGSIZE  # registers are masked to 16 bits
+
+    def reset(self):
+        super().reset()
+        # Setting up the one register
+        self.regfile[1] = 1
+
+    def _make_bus(self):
+        bus = MemoryBus(self.ADDRSIZE)
+        # Addresses below 0x100 are I/O: the buttons can be read, the LED
+        # matrix can be written, and writes elsewhere in I/O are ignored.
+        bus.map(0, 0x100, read=self._invalid_input, write=ignore_write, name="unused I/O")
+        bus.map(0, self.NUMBUTTONS, read=self.buttons.__getitem__, name="buttons")
+        bus.map(0, self.MATRIXSIZE**2, write=matrix_writer(self.matrix), name="matrix")
+        # Everything else is Data Memory
+        bus.map_ram(0x100, 2**self.ADDRSIZE, self.dmem)
+        return bus
+
+    def _invalid_input(self, addr):
+        raise Exception(
+                f"Invalid input address: {addr}  (valid input addresses: 0-{self.NUMBUTTONS-1})"
+        )
+
+    def decode(self, instruction):
+        # The instruction passed to the function is separated into its various fields based on the instruction type
+        # These are the op codes sorted into their instruction types
+        # R-Format = 0, 1, 3, 4, 6, 9
+        # I-Format = 2, 7, 8, 10
+        # J-Format = 5
+        op_mask = (0b1111 << 12)
+        op = (instruction & op_mask) >> 12
+        mnemonic = _OPS.get(op)
+
+        if op == 5:
+            # For J-Format instructions only the op code and target need to be extracted
+            tgt_mask = 0b111111111111
+            tgt = instruction & tgt_mask
+            # Fields not relevant to the instruction type are set to 0
+            return mnemonic, tgt, 0
+
+        elif (op == 2) or (op == 7) or (op == 8) or (op == 10):
+            # For I-Format instructions the op code, register 1, and immediate fields need to be extracted
+            reg_mask = (0b1111 << 8)
+            reg1 = (instruction & reg_mask) >> 8
+            imm_mask = 0b11111111
+            imm = instruction & imm_mask
+            # If the most significant bit of the immediate is a 1
+            # then the immediate is negative and must be adjusted accordingly
+            # (except for rand, which uses it as an unsigned upper bound)
+            if op != 2 and imm > 0b1111111:
+                imm -= 256
+            return mnemonic, reg1, imm
+
+        else:
+            # For R-Format instructions the op code, register 1, and register 2 fields are extracted
+            reg1_mask = (0b1111 << 8)
+            reg2_mask = (0b1111 << 4)
+            reg1 = (instruction & reg1_mask) >> 8
+            reg2 = (instruction & reg2_mask) >> 4
+            return mnemonic, reg1, reg2
+
+    def encode(self, instr):
+        op, a, b = instr
+        if op not in _OPCODES:
+            raise ValueError(f"Cannot encode {instr}.")
+        code = _OPCODES[op] << 12
+        if op == "jal":
+            return code | a
+        if op in ("rand", "beq", "bgt", "seti"):
+            return code | (a << 8) | (b & 0b11111111)
+        return code | (a << 8) | (b << 4)
+
+    def reg_access(self, instr):
+        op, a, b = instr
+        if op in ("add", "sub"):
+            reads, writes = (a, b), (a,)
+        elif op in ("load", "set"):
+            reads, writes = (b,), (a,)
+        elif op in ("rand", "seti"):
+            reads, writes = (), (a,)
+        elif op == "store":
+            reads, writes = (a, b), ()
+        elif op == "jal":
+            reads, writes = (), (15,)
+        elif op == "jr":
+            reads, writes = (a,), ()
+        elif op in self.BRANCH_OPS:
+            reads, writes = (a, 15), ()
+        else:
+            reads, writes = (), ()
+        # writes into $zero and $one are ignored
+        return reads, tuple(reg for reg in writes if reg > 1)
+
+    def counter_update(self, instr):
+        op, a, b = instr
+        if op in ("add", "sub") and a > 1:
+            return a, 0, b, 1 if op == "add" else -1
+        return None
+
+    def branch_condition(self, instr):
+        op, a, _ = instr
+        if op in self.BRANCH_OPS:
+            return a, "==" if op == "beq" else ">", 15
+        return None
+
+    def jump_target(self, addr, instr):
+        op, a, imm = instr
+        if op in self.BRANCH_OPS:
+            return addr + imm
+        if op == "jal":
+            return a
+        return None
+
+    def disassemble(self, addr, instr):
+        op, a, b = instr
+        if op is None:
+            return super().disassemble(addr, instr)
+        if op == "jal":
+            return f"jal {a:02x}"
+        if op == "jr":
+            return f"jr {_reg(a)}"
+        if op == "store":
+            # written as "store $addr $data", with the data register first in the word
+            return f"store {_reg(b)} {_reg(a)}"
+        if op in self.BRANCH_OPS:
+            return f"{op} {_reg(a)} {b:+d}  -> {addr + b:02x}"
+        if op in ("rand", "seti"):
+            return f"{op} {_reg(a)} {b}"
+        return f"{op} {_reg(a)} {_reg(b)}"
+
+    def random_instruction(self, op, rng, addr, length, footprint):
+        # DMEM addresses are counted down from the top, which seti can reach
+        # with a negative immediate, so at most 128 words are used
+        ram = [0xffff - i for i in range(min(footprint, 128))]
+        if op in ("add", "sub", "set"):
+            return op, rng.choice(_FREE_REGS), rng.randrange(self.NUMREG)
+        if op == "load":
+            return op, rng.choice(_FREE_REGS), 14
+        if op == "store":
+            return op, rng.randrange(self.NUMREG), 13
+        if op == "seti":
+            choice = rng.randrange(5)
+            if choice == 0:
+                data_addr = rng.choice(ram + list(range(self.NUMBUTTONS)))
+                return op, 14, data_addr - 0x10000 if data_addr > 0xff else data_addr
+            if choice == 1:
+                data_addr = rng.choice(ram + list(range(self.MATRIXSIZE**2)))
+                return op, 13, data_addr - 0x10000 if data_addr > 0xff else data_addr
+            if choice == 2:
+                return op, 12, rng.randrange(min(length, 128))
+            return op, rng.choice(_FREE_REGS), rng.randint(-128, 127)
+        if op == "jal":
+            return op, rng.randrange(length), 0
+        if op == "jr":
+            return op, 12, 0
+        if op in self.BRANCH_OPS:
+            targets = [t for t in range(max(addr - 128, 0), min(addr + 128, length)) if t != addr]
+            return op, rng.randrange(self.NUMREG), rng.choice(targets) - addr
+        if op == "rand":
+            return op, rng.choice(_FREE_REGS), rng.randrange(256)
+        return super().random_instruction(op, rng, addr, length, footprint)
+
+    def jump_to_start(self, addr):
+        return "jal", 0, 0
+
+    def _make_handlers(self):
+        regfile = self.regfile
+        page_bits = self.bus.page_bits
+        mem_read = self.bus.readers
+        mem_write = self.bus.writers
+        mem_count = self.bus.accesses
+
+        def setreg(reg, data):
+            # don't allow writes into registers $0 ($zero) and $1 ($one)
+            if reg > 1:
+                # constrain data to 16 bits (a bit hacky to do it here, but oh well)
+                regfile[reg] = data & 0xffff
+
+        def add(pc, reg1, reg2):
+            # reg1 = reg1 + reg2
+            setreg(reg1, regfile[reg1] + regfile[reg2])
+            return pc
+
+        def sub(pc, reg1, reg2):
+            # reg1 = reg1 - reg 2
+            setreg(reg1, regfile[reg1] - regfile[reg2])
+            return pc
+
+        def seti(pc, reg1, imm):
+            # reg1 = immediate
+            setreg(reg1, imm)
+            return pc
+
+        def set_(pc, reg1, reg2):
+            # reg1 = reg2
+            setreg(reg1, regfile[reg2])
+            return pc
+
+        def jr(pc, reg1, _):
+            # PC = address in reg1
+            return regfile[reg1]
+
+        def jal(pc, tgt, _):
+            # Current PC is stored in $15
+            # PC = Immediate (target)
+            regfile[15] = pc
+            return tgt
+
+        def load(pc, reg1, reg2):
+            # reg1 gets data read from I/O or DMEM at address reg2
+            addr = regfile[reg2]
+            mem_count[0] += 1
+            setreg(reg1, mem_read[addr >> page_bits](addr))
+            return pc
+
+        def store(pc, reg1, reg2):
+            # I/O or DMEM at address reg2 = Value of reg1
+            addr = regfile[reg2]
+            mem_count[1] += 1
+            mem_write[addr >> page_bits](addr, regfile[reg1])
+            return pc
+
+        def beq(pc, reg1, imm):
+            # if reg1 == implicit register, jump to PC + immediate
+            # (- 1 counteracts the PC increment in the run loop)
+            if regfile[reg1] == regfile[15]:
+                return pc + imm - 1
+            return pc
+
+        def bgt(pc, reg1, imm):
+            # if reg1 > implicit register, jump to PC + immediate
+            if regfile[reg1] > regfile[15]:
+                return pc + imm - 1
+            return pc
+
+        def rand(pc, reg1, imm):
+            # reg1 = random value from 0-immediate
+            setreg(reg1, random.randint(0, imm))
+            return pc
+
+        def nop(pc, a, b):
+            return pc
+
+        return {
+            "add": add, "sub": sub, "rand": rand, "load": load, "store": store,
+            "jal": jal, "jr": jr, "beq": beq, "bgt": bgt, "set": set_,
+            "seti": seti, None: nop,
+        }
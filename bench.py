@@ -0,0 +1,194 @@
+#!/bin/env python3
+#
+# bench.py  --  Measure simulator speed, and soak test it with random programs.
+#
+# Author: Mark Liffiton
+#
+# By default, runs every test program under tests/ plus a few generated
+# workloads (see stress.py) for each architecture, and reports the best
+# instructions per second of several runs of each.  A program that fails
+# before running all of the cycles (e.g., by running off the end of its code)
+# is reported as failing instead, since its speed can't be measured.
+#
+# With --soak, instead generates and runs random programs with random
+# settings for the given number of seconds, each on two simulators: one with
+# every speedup and instrumentation on (fast loops, memoized calls, coverage,
+# timing), and one running every instruction plainly.  Any difference between
+# the two, or any exception, is a failure: the program is saved for
+# reproducing it, and the exit status is 1.
+#
+import argparse
+import importlib
+import os
+import random
+import time
+
+import stress
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHS = ["S20_SIM", "S21_ApplePi"]
+
+# Generated workloads: name -> (opcode mix, branch density, DMEM footprint)
+PROFILES: dict[str, tuple[dict[str, float] | None, float, int]] = {
+    "random": (None, 0.15, 16),
+    "alu": (stress.parse_mix("add=4,sub=4,addi=4,set=2,seti=2,assigni=2,sgt=2,load,store"), 0.1, 16),
+    "memory": (stress.parse_mix("load=6,store=6,seti=2,assigni=2,add,addi"), 0.1, 256),
+    "branchy": (None, 0.5, 16),
+}
+
+
+def workloads(arch_name: str) -> list[tuple[str, list[int]]]:
+    """ Return (name, machine code) for each workload of the architecture. """
+    sim = importlib.import_module(f"archs.{arch_name}").Simulator()
+    tests_dir = os.path.join(BASE_DIR, "tests", arch_name.replace("_", "-"))
+    loads = []
+    if os.path.isdir(tests_dir):
+        for filename in sorted(os.listdir(tests_dir)):
+            if filename.endswith(".bin"):
+                sim.load_bin(os.path.join(tests_dir, filename))
+                loads.append((filename, sim.imem))
+    for name, (mix, density, footprint) in PROFILES.items():
+        loads.append((name, stress.generate(sim, 200, mix, density, footprint, seed=0)))
+    return loads
+
+
+def bench(arch_name: str, words: list[int], cycles: int, repeat: int) -> dict:
+    """ Run repeat runs of cycles from reset.
+
+    Returns {"ips": the best instructions per second}, or {"error": the
+    error, "cycles": cycles run before it} if the program fails.
+    """
+    sim = importlib.import_module(f"archs.{arch_name}").Simulator()
+    sim.load_imem(words)
+    best = 0.0
+    for _ in range(repeat):
+        sim.reset()
+        random.seed(0)
+        start = time.perf_counter()
+        try:
+            sim.run(cycles)
+        except Exception as e:
+            return {"error": str(e), "cycles": sim.stats()["last_run"]["cycles"]}
+        best = max(best, cycles / (time.perf_counter() - start))
+    return {"ips": round(best)}
+
+
+def soak_one(seed: int, cycles: int) -> tuple[str, list[int], str | None]:
+    """ Generate and cross-check one random program, all chosen by seed.
+
+    Returns (architecture, program, description of the failure or None).
+    """
+    rng = random.Random(seed)
+    arch_name = rng.choice(ARCHS)
+    arch = importlib.import_module(f"archs.{arch_name}")
+    fast = arch.Simulator()
+    plain = arch.Simulator()
+    mix = {op: rng.choice([0, 1, 1, 4]) for op in fast._make_handlers() if op is not None} if rng.random() < 0.5 else None
+    length = rng.randint(2, 513 if arch_name == "S20_SIM" else 1000)
+    words = []
+    try:
+        words = stress.generate(fast, length, mix, rng.random(), rng.choice([1, 4, 16, 256]), seed)
+        for sim in (fast, plain):
+            sim.load_imem(words)
+            sim.enable_coverage()
+            sim.enable_timing()
+        fast.enable_memo()
+        plain.set_fast_loops(False)
+
+        # Run in pieces, changing the buttons and sometimes stopping at
+        # breakpoints, so traps are cut short by budgets and stops too
+        ran = 0
+        while ran < cycles:
+            buttons = [rng.randint(0, 1) for _ in fast.buttons]
+            n = rng.randint(1, cycles - ran)
+            until = rng.sample(range(length), min(length, 3)) if rng.random() < 0.3 else None
+            random_seed = rng.getrandbits(32)
+            results = []
+            for sim in (fast, plain):
+                sim.buttons[:] = buttons
+                random.seed(random_seed)
+                results.append(sim.run(n, until))
+            if results[0] != results[1]:
+                return arch_name, words, f"run({n}, {until}) ran {results[0]} vs. {results[1]} cycles"
+            ran += n
+
+        for what, get in [
+            ("PC", lambda sim: sim.PC),
+            ("regfile", lambda sim: sim.regfile),
+            ("dmem", lambda sim: sim.dmem),
+            ("matrix", lambda sim: sim.matrix),
+            ("coverage", lambda sim: (sim.coverage.fallthrough, sim.coverage.taken)),
+            ("stats", _comparable_stats),
+        ]:
+            if get(fast) != get(plain):
+                return arch_name, words, f"{what} differs: {get(fast)} vs. {get(plain)}"
+    except Exception as e:
+        return arch_name, words, f"{type(e).__name__}: {e}"
+    return arch_name, words, None
+
+
+def _comparable_stats(sim) -> dict:
+    # Everything in stats() that doesn't depend on how fast it ran
+    stats = sim.stats()
+    for key in ("last_run", "step_seconds", "render_seconds", "memo"):
+        stats.pop(key, None)
+    return stats
+
+
+def soak(seconds: float, cycles: int, first_seed: int, save_dir: str) -> int:
+    end = time.monotonic() + seconds
+    seed = first_seed
+    while time.monotonic() < end:
+        arch_name, words, failure = soak_one(seed, cycles)
+        if failure is not None:
+            binfile = os.path.join(save_dir, f"soak_{arch_name}_{seed}.bin")
+            with open(binfile, "w") as f:
+                f.write("\n".join(f"{word:04x}" for word in words) + "\n")
+            print(f"Seed {seed} ({arch_name}) failed: {failure}")
+            print(f"Program saved to {binfile}")
+            return 1
+        seed += 1
+    print(f"Soaked {seed - first_seed} programs (seeds {first_seed} to {seed - 1}) with no failures.")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure simulator speed, or soak test it with random programs.")
+    parser.add_argument("--arch", choices=ARCHS, action="append", help="architecture(s) to benchmark (default: all)")
+    parser.add_argument("--cycles", type=int,
+                        help="cycles per run (default: 200000), or per program when soaking (default: 20000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each workload, reporting the best (default: 3)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("-o", "--output", help="also write the results to this file")
+    parser.add_argument("--soak", type=float, metavar="SECONDS", help="soak test for this many seconds instead")
+    parser.add_argument("--seed", type=int, default=0, help="first seed when soaking (default: 0)")
+    parser.add_argument("--save-dir", default=".", help="where to save a failing soak program (default: .)")
+    args = parser.parse_args()
+
+    if args.soak is not None:
+        return soak(args.soak, args.cycles or 20_000, args.seed, args.save_dir)
+
+    results = []
+    for arch_name in args.arch or ARCHS:
+        for name, words in workloads(arch_name):
+            result = bench(arch_name, words, args.cycles or 200_000, args.repeat)
+            results.append({"arch": arch_name, "workload": name, **result})
+
+    if args.json:
+        import json
+        report = json.dumps(results, indent=2)
+    else:
+        report = "\n".join(
+            f"{r['arch']:12}  {r['workload']:20}  {r['ips']:>12,} IPS" if "ips" in r else
+            f"{r['arch']:12}  {r['workload']:20}  failed after {r['cycles']:,} cycles: {r['error']}"
+            for r in results
+        )
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,266 @@
+#
+# call_memo.py  --  Memoizing subroutine calls for 256sim.
+#
+# Authors: Mark Liffiton
+#
+# Programs often call the same small helper (a multiply by repeated adds, a
+# pixel index computation, ...) with the same arguments over and over.  Once
+# a call has been simulated, a CallMemo knows everything it depended on and
+# everything it did:
+#  - inputs: the registers and memory words it read before writing them
+#  - outputs: the final values of the registers and memory words it wrote
+# along with how many cycles it took and which instructions it executed.  A
+# later call from the same call site finding the same input values would do
+# exactly the same thing, so the outputs are applied in one step instead.
+#
+# Entries are keyed by call site (the address of the call instruction), not
+# by the callee's entry address.  A call leaves its return address in a
+# register (e.g., $15 for jal on S21_ApplePi), and the callee normally reads
+# it to return, so the return address is one of its inputs.
+# Calls of the same helper from different sites therefore never have
+# matching inputs, and keying by entry address wouldn't share anything.
+# Keying by site also keeps the return address (site + 1) fixed for every
+# entry.
+#
+# Calls are recorded by executing them for real, with the regfile and every
+# memory bus wrapped to watch each access.  A callee that touches an I/O
+# device or executes a random-number instruction can't be replayed, so it is
+# never memoized again.
+#
+import collections
+from collections.abc import Callable
+
+from traps import TrapInterrupted, TrapResult
+
+
+class CallEntry:
+    """ One recorded call: its inputs and outputs, and what it executed. """
+    def __init__(
+        self,
+        outputs: tuple[tuple[tuple[int, int], ...], tuple[tuple[int, int, int], ...]],
+        cycles: int,
+        executed: list[tuple[int, int, int]],
+        accesses: list[tuple[int, int]]
+    ) -> None:
+        self.reg_writes, self.mem_writes = outputs  # ((reg, value), ...), ((bus, addr, value), ...)
+        self.cycles = cycles
+        self.executed = executed  # [(addr, times executed, times taken), ...]
+        self.accesses = accesses  # (reads, writes) for each bus
+        self.addrs = frozenset(addr for addr, _, _ in executed)
+
+
+class CallMemo:
+    """ Recorded calls for one Simulator's program, used as traps on the
+        instructions in the architecture's CALL_OPS (see BaseSimulator).
+
+    Parameters:
+     - capacity: the most calls to remember; the least recently used are
+                 forgotten first
+     - max_cycles: calls still running after this many cycles aren't recorded
+    """
+    MAX_SIGNATURES = 8  # different input sets remembered per call site
+
+    def __init__(self, capacity: int = 1024, max_cycles: int = 10_000) -> None:
+        self.capacity = capacity
+        self.max_cycles = max_cycles
+        # (call site, signature, input values) -> CallEntry, least recently used first
+        self.entries: collections.OrderedDict[tuple, CallEntry] = collections.OrderedDict()
+        # call site -> the signatures (which registers and addresses were inputs) seen there
+        self.signatures: dict[int, list[tuple]] = {}
+        self.impure: set[int] = set()  # call sites whose callees do I/O or use random numbers
+        self.hits = 0
+        self.misses = 0
+        self.cycles_saved = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "cycles_replayed": self.cycles_saved,
+            "entries": len(self.entries),
+            "impure_call_sites": len(self.impure),
+        }
+
+    def call(self, site: int, sim, budget: int | None, stops: frozenset[int]) -> TrapResult | None:
+        """ A Trap (once site is bound) for the call instruction at site:
+            replay the call if it has been seen with these inputs, or else
+            execute and record it.
+        """
+        if site in self.impure:
+            return None
+        buses = sim._buses()
+
+        for signature in self.signatures.get(site, ()):
+            regs, mems = signature
+            values = (
+                tuple(sim.regfile[reg] for reg in regs),
+                tuple(buses[bus].load(addr) for bus, addr in mems),
+            )
+            entry = self.entries.get((site, signature, values))
+            if entry is None:
+                continue
+            if entry.addrs & stops or budget is not None and entry.cycles > budget:
+                return None  # run it normally, to stop where asked
+            self.entries.move_to_end((site, signature, values))
+            self.hits += 1
+            self.cycles_saved += entry.cycles
+            for reg, value in entry.reg_writes:
+                sim.regfile[reg] = value
+            for bus, addr, value in entry.mem_writes:
+                buses[bus].store(addr, value)
+            for bus, (reads, writes) in zip(buses, entry.accesses):
+                bus.accesses[0] += reads
+                bus.accesses[1] += writes
+            return site + 1, entry.cycles, entry.executed
+
+        self.misses += 1
+        return self._record(sim, site, buses, budget, stops)
+
+    def _record(self, sim, site: int, buses: list, budget: int | None, stops: frozenset[int]) -> TrapResult:
+        # Execute the call one instruction at a time through watched handlers
+        # until it returns to site + 1 (or has to stop, unrecorded)
+        watch = _Watch(sim.regfile, buses)
+        handlers = watch.handlers(sim)
+        code = sim._decoded
+        limit = self.max_cycles if budget is None else min(budget, self.max_cycles)
+        start_accesses = [tuple(bus.accesses) for bus in buses]
+        counts: dict[int, list[int]] = {}
+        pc = site
+        cycles = 0
+        complete = False
+        try:
+            while cycles < limit:
+                op, a, b = code[pc]
+                if op in sim.RANDOM_OPS:
+                    self._give_up(site)
+                    break
+                next_pc = pc + 1
+                new_pc = handlers[op](next_pc, a, b)
+                cycles += 1
+                count = counts.setdefault(pc, [0, 0])
+                count[0] += 1
+                if sim._taken(pc, new_pc):
+                    count[1] += 1
+                pc = new_pc
+                if watch.io:
+                    self._give_up(site)
+                    break
+                if pc == site + 1:
+                    complete = True
+                    break
+                if pc in stops:
+                    break
+        except Exception as e:
+            # Stop at the failing instruction, with everything before it
+            # counted, just as without memoization
+            executed = [(addr, count, taken) for addr, (count, taken) in counts.items()]
+            raise TrapInterrupted((pc, cycles, executed), e) from e
+
+        executed = [(addr, count, taken) for addr, (count, taken) in counts.items()]
+        if complete:
+            accesses = [
+                (bus.accesses[0] - reads, bus.accesses[1] - writes)
+                for bus, (reads, writes) in zip(buses, start_accesses)
+            ]
+            self._store(site, watch, CallEntry(watch.outputs(), cycles, executed, accesses))
+        return pc, cycles, executed
+
+    def _store(self, site: int, watch: "_Watch", entry: CallEntry) -> None:
+        signature, values = watch.inputs()
+        signatures = self.signatures.setdefault(site, [])
+        if signature not in signatures:
+            signatures.append(signature)
+            if len(signatures) > self.MAX_SIGNATURES:
+                del signatures[0]
+        self.entries[(site, signature, values)] = entry
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _give_up(self, site: int) -> None:
+        # Forget the site's calls; its callee can't be replayed
+        self.impure.add(site)
+        self.signatures.pop(site, None)
+        for key in [key for key in self.entries if key[0] == site]:
+            del self.entries[key]
+
+
+class _Watch:
+    """ Stands in for the regfile and memory buses while a call is recorded,
+        passing every access through and noting the call's inputs and outputs.
+    """
+    def __init__(self, regfile: list[int], buses: list) -> None:
+        self.regfile = regfile
+        self.buses = buses
+        self.reg_reads: dict[int, int] = {}    # value of each register when first read, if read before written
+        self.reg_writes: dict[int, int] = {}   # last value written to each register
+        self.mem_reads: dict[tuple[int, int], int] = {}   # same, for (bus, addr)
+        self.mem_writes: dict[tuple[int, int], int] = {}
+        self.io = False  # whether anything but RAM was accessed
+
+    def handlers(self, sim) -> dict:
+        # The architecture's handlers, built to use this in place of the
+        # regfile and the buses' page tables
+        saved_regfile = sim.regfile
+        saved_pages = [(bus.readers, bus.writers) for bus in self.buses]
+        try:
+            sim.regfile = self
+            for i, bus in enumerate(self.buses):
+                bus.readers = _WatchedPages(self, i, bus, bus.readers, write=False)
+                bus.writers = _WatchedPages(self, i, bus, bus.writers, write=True)
+            return sim._make_handlers()
+        finally:
+            sim.regfile = saved_regfile
+            for bus, (readers, writers) in zip(self.buses, saved_pages):
+                bus.readers, bus.writers = readers, writers
+
+    def __getitem__(self, reg: int) -> int:
+        value = self.regfile[reg]
+        if reg not in self.reg_writes:
+            self.reg_reads.setdefault(reg, value)
+        return value
+
+    def __setitem__(self, reg: int, value: int) -> None:
+        self.regfile[reg] = value
+        self.reg_writes[reg] = value
+
+    def inputs(self) -> tuple[tuple, tuple]:
+        """ Return (signature, values) of the inputs read. """
+        regs = tuple(self.reg_reads)
+        mems = tuple(self.mem_reads)
+        return (regs, mems), (tuple(self.reg_reads.values()), tuple(self.mem_reads.values()))
+
+    def outputs(self) -> tuple[tuple[tuple[int, int], ...], tuple[tuple[int, int, int], ...]]:
+        return (
+            tuple(self.reg_writes.items()),
+            tuple((bus, addr, value) for (bus, addr), value in self.mem_writes.items()),
+        )
+
+
+class _WatchedPages:
+    """ A bus's readers or writers, as seen by a watched handler. """
+    def __init__(self, watch: _Watch, index: int, bus, pages: list, write: bool) -> None:
+        self.watch = watch
+        self.index = index
+        self.bus = bus
+        self.pages = pages
+        self.write = write
+
+    def __getitem__(self, page: int) -> Callable:
+        func = self.pages[page]
+        watch = self.watch
+        if not self.bus.ram_pages[page]:
+            watch.io = True
+            return func
+        index = self.index
+        if self.write:
+            def write(addr: int, data: int) -> None:
+                func(addr, data)
+                watch.mem_writes[(index, addr)] = data
+            return write
+
+        def read(addr: int) -> int:
+            value = func(addr)
+            if (index, addr) not in watch.mem_writes:
+                watch.mem_reads.setdefault((index, addr), value)
+            return value
+        return read
@@ -0,0 +1,172 @@
+#
+# delay_loops.py  --  Fast-forwarding counted delay loops for 256sim.
+#
+# Authors: Mark Liffiton
+#
+# Programs for these CPUs slow themselves down to human speed with loops like
+#
+#     loop: addi $2 -1          loop: sub $2 $one
+#           bne $2 loop               bgt $2 loop
+#
+# which can spin for most of a program's cycles while changing nothing but
+# one register.  Such a loop's exit is easy to compute directly: its counter
+# moves by the same amount every iteration, and its branch compares the
+# counter with a register the loop doesn't touch.  find_delay_loops() finds
+# them statically, and the run loop asks each one to skip ahead (see
+# BaseSimulator._take_trap()), still counting every cycle it skipped.
+#
+from math import gcd
+
+from traps import TrapResult
+
+
+class DelayLoop:
+    """ A loop of instructions head..branch-1 that each add to the counter
+        register, closed by a conditional branch at branch that compares the
+        counter with the limit register and jumps back to head.
+
+    Parameters:
+     - head, branch: IMEM addresses of the first instruction and the branch
+     - reg: the counter register
+     - updates: (const, src, scale) for each instruction in the body, which
+                adds const + scale * regfile[src] to the counter (src is None
+                for a constant update)
+     - cond: the branch's condition on (counter, limit): "==", "!=", or ">"
+     - limit: the register the counter is compared with
+     - modulus: registers wrap modulo this, or None if they don't wrap
+    """
+    def __init__(
+        self,
+        head: int,
+        branch: int,
+        reg: int,
+        updates: list[tuple[int, int | None, int]],
+        cond: str,
+        limit: int,
+        modulus: int | None
+    ) -> None:
+        self.head = head
+        self.branch = branch
+        self.reg = reg
+        self.updates = updates
+        self.cond = cond
+        self.limit = limit
+        self.modulus = modulus
+        self.addrs = frozenset(range(head, branch + 1))
+
+    def fast_forward(self, sim, budget: int | None, stops: frozenset[int]) -> TrapResult | None:
+        """ Run as many whole iterations as possible at once, given the PC is
+            at the head of the loop.
+
+        Parameters:
+         - sim: the Simulator, whose registers are updated
+         - budget: the most cycles that may be run (None for no limit)
+         - stops: addresses at which the run must stop
+
+        Returns a TrapResult, or None if there's nothing to skip (e.g., the
+        budget doesn't allow a whole iteration, or the loop would never exit
+        in an unlimited run), so the caller should run the loop normally.
+        """
+        if self.addrs & stops:
+            return None  # every pass through the loop must stop there
+        regfile = sim.regfile
+        start = regfile[self.reg]
+        step = sum(const + (scale * regfile[src] if src is not None else 0) for const, src, scale in self.updates)
+        exit_after, safe = self._iterations(start, step, regfile[self.limit])
+
+        per_iteration = len(self.updates) + 1
+        most = budget // per_iteration if budget is not None else None
+        if exit_after is not None and (most is None or exit_after <= most):
+            iterations, exited = exit_after, True
+        else:
+            # Only iterations that are certain to loop again
+            limits = [k for k in (safe, most) if k is not None]
+            if not limits:
+                return None
+            iterations, exited = min(limits), False
+        if iterations <= 0:
+            return None
+
+        value = start + iterations * step
+        regfile[self.reg] = value % self.modulus if self.modulus else value
+        taken = iterations - 1 if exited else iterations
+        executed = [(addr, iterations, 0) for addr in range(self.head, self.branch)]
+        executed.append((self.branch, iterations, taken))
+        new_pc = self.branch + 1 if exited else self.head
+        return new_pc, iterations * per_iteration, executed
+
+    def _iterations(self, start: int, step: int, limit: int) -> tuple[int | None, int | None]:
+        """ Return (exit_after, safe): the number of iterations after which
+            the loop exits (None if it never does, as far as can be told), and
+            the number of iterations it is certain to continue for (None for
+            no limit).
+        """
+        modulus = self.modulus
+        if modulus:
+            step %= modulus
+        if self.cond == "==":
+            # Loops while the counter equals the limit: at most twice, unless it never moves
+            if (start + step) % modulus != limit if modulus else start + step != limit:
+                return 1, 0
+            return (None, None) if step == 0 else (2, 1)
+
+        if self.cond == "!=":
+            # Loops until the counter lands exactly on the limit
+            distance = limit - start
+            if not modulus:
+                if step == 0 or distance % step or distance // step < 1:
+                    return (1, 0) if step == 0 and distance == 0 else (None, None)
+                k = distance // step
+                return k, k - 1
+            # Solve start + k * step == limit (mod modulus) for the smallest k >= 1
+            g = gcd(step, modulus)
+            if distance % g:
+                return None, None
+            period = modulus // g
+            k = (distance // g) * pow(step // g, -1, period) % period if period > 1 else 0
+            k = k or period
+            return k, k - 1
+
+        # ">": loops while the counter is above the limit.  The counter only
+        # moves one way until it wraps, so look no further than that.
+        if modulus and step > modulus // 2:
+            step -= modulus
+        if step < 0:
+            k = max(1, -((start - limit) // step))  # first k with start + k*step <= limit
+            room = start // -step if modulus else None
+        elif step > 0:
+            k = 1 if start + step <= limit else None
+            room = (modulus - 1 - start) // step if modulus else None
+        else:
+            k = 1 if start <= limit else None
+            room = None
+        if k is not None and (room is None or k <= room):
+            return k, k - 1
+        return None, room
+
+
+def find_delay_loops(sim) -> list[DelayLoop]:
+    """ Find every delay loop in sim's loaded program, using its
+        counter_update(), branch_condition(), and jump_target() hooks.
+    """
+    code = sim._decoded
+    loops = []
+    for branch, instr in enumerate(code):
+        head = sim.jump_target(branch, instr)
+        condition = sim.branch_condition(instr)
+        if head is None or condition is None or not 0 <= head < branch:
+            continue
+        reg, cond, limit = condition
+        updates = []
+        for addr in range(head, branch):
+            update = sim.counter_update(code[addr])
+            if update is None or update[0] != reg:
+                break
+            _, const, src, scale = update
+            if src == reg:
+                break  # the step would change as the loop runs
+            updates.append((const, src, scale))
+        else:
+            if limit != reg:
+                loops.append(DelayLoop(head, branch, reg, updates, cond, limit, sim.REG_MODULUS))
+    return loops
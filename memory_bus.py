@@ -0,0 +1,138 @@
+#
+# memory_bus.py  --  Page-indexed address decoding for simulated memory and I/O.
+#
+# Authors: Mark Liffiton
+#
+from collections.abc import Callable
+
+Reader = Callable[[int], int]
+Writer = Callable[[int, int], None]
+
+
+class MemoryBus:
+    """ Maps an address space onto devices (RAM, buttons, LEDs, ...).
+
+    The address space is split into pages of 2**page_bits words, and each
+    page has one reader and one writer, so an access costs a single table
+    lookup:
+
+        data = bus.readers[addr >> bus.page_bits](addr)
+        bus.writers[addr >> bus.page_bits](addr, data)
+
+    Readers and writers always receive the full address.  Handlers in the run
+    loop should hoist the tables and shift into locals and index them
+    directly as above; load() and store() are for everything else.
+
+    Traffic is counted cheaply: handlers bump accesses[0] (reads) or
+    accesses[1] (writes) for every access, and each device mapped with a
+    name counts its own reads and writes in device_accesses[name].  Anything
+    not handled by a named device is plain memory.
+    """
+    def __init__(self, addrsize: int, page_bits: int = 2) -> None:
+        """
+        Parameters:
+         - addrsize: int number of bits in an address
+         - page_bits: int number of address bits within one page; all mapped
+                      ranges must be aligned to pages of this size
+        """
+        self.addrsize = addrsize
+        self.page_bits = min(page_bits, addrsize)
+        num_pages = 2 ** (addrsize - self.page_bits)
+        self.readers: list[Reader] = [self._unmapped_read] * num_pages
+        self.writers: list[Writer] = [self._unmapped_write] * num_pages
+        self.accesses: list[int] = [0, 0]
+        self.device_accesses: dict[str, list[int]] = {}
+        self.ram_pages = bytearray(num_pages)  # 1 for each page mapped by map_ram()
+
+    def map(
+        self,
+        start: int,
+        end: int,
+        read: Reader | None = None,
+        write: Writer | None = None,
+        name: str | None = None
+    ) -> None:
+        """ Map the addresses [start, end) to a device.
+
+        Parameters:
+         - start, end: int bounds of the address range, page-aligned
+         - read: function (addr) -> data for reads in this range; if None,
+                 reads in the range are left as they were
+         - write: function (addr, data) for writes in this range; if None,
+                  writes in the range are left as they were
+         - name: if given, count accesses to this device under that name in
+                 device_accesses (use the same name to map more of a device)
+        """
+        page_size = 1 << self.page_bits
+        if start % page_size or end % page_size or not 0 <= start < end <= 2 ** self.addrsize:
+            raise ValueError(
+                f"Cannot map [{start:#x}, {end:#x}): ranges must lie within the bus and be aligned to {page_size}-word pages."
+            )
+        if name is not None:
+            counts = self.device_accesses.setdefault(name, [0, 0])
+            if read is not None:
+                read = _counted_read(read, counts)
+            if write is not None:
+                write = _counted_write(write, counts)
+        first, last = start >> self.page_bits, end >> self.page_bits
+        self.ram_pages[first:last] = bytes(last - first)
+        if read is not None:
+            self.readers[first:last] = [read] * (last - first)
+        if write is not None:
+            self.writers[first:last] = [write] * (last - first)
+
+    def map_ram(self, start: int, end: int, mem: list[int]) -> None:
+        """ Map the addresses [start, end) directly onto the list mem, which is
+            indexed by the full address (so it must be at least end long).
+        """
+        # The list's own bound methods: no Python-level call per access
+        self.map(start, end, mem.__getitem__, mem.__setitem__)
+        first, last = start >> self.page_bits, end >> self.page_bits
+        self.ram_pages[first:last] = b"\x01" * (last - first)
+
+    def is_ram(self, addr: int) -> bool:
+        """ Whether addr is plain memory (mapped by map_ram()) rather than a device. """
+        return bool(self.ram_pages[addr >> self.page_bits])
+
+    def load(self, addr: int) -> int:
+        return self.readers[addr >> self.page_bits](addr)
+
+    def store(self, addr: int, data: int) -> None:
+        self.writers[addr >> self.page_bits](addr, data)
+
+    @staticmethod
+    def _unmapped_read(addr: int) -> int:
+        raise Exception(f"Invalid read address: {addr}  (no device mapped there)")
+
+    @staticmethod
+    def _unmapped_write(addr: int, data: int) -> None:
+        raise Exception(f"Invalid write address: {addr}  (no device mapped there)")
+
+
+def _counted_read(read: Reader, counts: list[int]) -> Reader:
+    def counted(addr: int) -> int:
+        counts[0] += 1
+        return read(addr)
+    return counted
+
+
+def _counted_write(write: Writer, counts: list[int]) -> Writer:
+    def counted(addr: int, data: int) -> None:
+        counts[1] += 1
+        write(addr, data)
+    return counted
+
+
+def ignore_write(addr: int, data: int) -> None:
+    """ A writer for address ranges where writes are silently dropped. """
+    pass
+
+
+def matrix_writer(matrix: list[list[int]], base: int = 0) -> Writer:
+    """ A writer for an LED matrix mapped in row-major order starting at base. """
+    width = len(matrix[0])
+
+    def write(addr: int, data: int) -> None:
+        addr -= base
+        matrix[addr // width][addr % width] = data
+    return write
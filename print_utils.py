@@ -83,6 +83,23 @@ def print_mem(
     _mem_cache[name] = array[:], max_mod_addr
 
 
+def print_disasm(lines: list[tuple[int, int, str]], name: str, highlight: int|None=None) -> None:
+    """ Display a listing of instructions.
+
+    Parameters:
+     - lines: list of (address, machine code word, assembly) for each line
+     - highlight: address of the line to highlight (e.g., the PC)
+    """
+    print_head(name)
+
+    addrsize = max(2, len(f"{lines[-1][0]:x}")) if lines else 2
+    for addr, word, asm in lines:
+        line = f"{addr:0{addrsize}x}: {word:04x}  {asm}"
+        if addr == highlight:
+            line = f"[34;1;4m{line}[m"
+        print(line)
+
+
 def print_input(buttons: list[int], name: str) -> None:
     print_head(name)
 
@@ -115,3 +132,29 @@ def print_matrix(matrix: list[list[int]], name: str) -> None:
         for row in range(len(matrix))
     )
     print(matrix_str)
+
+
+def print_stats(stats: dict, name: str) -> None:
+    """ Display the runtime statistics from Simulator.stats(). """
+    print_head(name)
+
+    last = stats["last_run"]
+    total_seconds = stats["step_seconds"] + stats["render_seconds"]
+    render_pct = 100 * stats["render_seconds"] / total_seconds if total_seconds else 0.0
+
+    print(f"Cycles:         {stats['cycles']}  (resets: {stats['resets']})")
+    print(f"Last run:       {last['cycles']} cycles in {last['seconds']:.3f}s = {last['ips']:,.0f} instructions/sec")
+    print(f"DMEM:           {stats['dmem_reads']} reads, {stats['dmem_writes']} writes")
+    print(f"I/O:            {stats['io_reads']} reads, {stats['io_writes']} writes  (matrix updates: {stats['matrix_updates']})")
+    for device, counts in stats["devices"].items():
+        print(f"  {device + ':':13} {counts['reads']} reads, {counts['writes']} writes")
+    print(f"Time:           {stats['step_seconds']:.3f}s simulating, {stats['render_seconds']:.3f}s printing ({render_pct:.0f}% printing)")
+    timing = stats.get("timing")
+    if timing:
+        stalls = timing["stalls"]
+        print(f"Hardware:       {timing['cycles']} clock cycles for {timing['instructions']} instructions (CPI {timing['cpi']:.2f})")
+        print(f"  stalls:       {stalls['taken_branch']} taken branch, {stalls['jump']} jump, {stalls['load_use']} load-use")
+    memo = stats.get("memo")
+    if memo:
+        print(f"Memoized calls: {memo['hits']} replayed ({memo['cycles_replayed']} cycles), {memo['misses']} executed, "
+              f"{memo['entries']} remembered, {memo['impure_call_sites']} call sites not memoizable")
@@ -0,0 +1,214 @@
+#
+# render_process.py  --  Drawing a watched simulation from a separate process.
+#
+# Authors: Mark Liffiton
+#
+# Normally, watch_n() stops the CPU for every frame while the whole state is
+# formatted and written to the terminal.  With a RenderProcess, the simulator
+# only publishes its state into shared memory, and a second process draws it
+# at its own frame rate, so a slow terminal can't slow down the simulation.
+#
+# The shared buffer is an array of 64-bit ints:
+#
+#     seq | PC | regfile | buttons | matrix | DMEM block stamps | DMEM
+#
+# seq makes it a seqlock: it is odd while the simulator is writing, and the
+# renderer retries any read during which seq changed.  DMEM is split into
+# blocks, and only blocks that changed since the last publish are written,
+# each stamped with the seq that wrote it, so the renderer copies only the
+# blocks stamped after its last read.
+#
+# The renderer starts from this process's print_utils memory cache and sends
+# its own back when it's done, so highlighting of changed values (and DMEM
+# shown only up to the highest address modified) carries on across watches
+# just as when printing in this process.
+#
+from array import array
+import importlib
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+_SEQ = 0
+_PC = 1
+_HEADER = 2
+
+
+class SharedState:
+    """ A Simulator's displayed state (PC, regfile, buttons, matrix, and
+        DMEM) in shared memory, written by publish() and read by read().
+
+    Parameters:
+     - sim: a Simulator, to size the buffer for
+     - name: the name of an existing buffer to attach to, or None to create one
+    """
+    BLOCK = 256  # DMEM words per block
+
+    def __init__(self, sim, name: str | None = None) -> None:
+        self._regs = _HEADER
+        self._buttons = self._regs + len(sim.regfile)
+        self._matrix = self._buttons + len(sim.buttons)
+        self._stamps = self._matrix + len(sim.matrix) ** 2
+        self._dmem = self._stamps + -(-len(sim.dmem) // self.BLOCK)
+        size = 8 * (self._dmem + len(sim.dmem))
+
+        self.shm = shared_memory.SharedMemory(name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.values = self.shm.buf[:size].cast("q")
+        self._published: list[int] = []  # DMEM as of the last publish()
+
+    def publish(self, sim) -> None:
+        """ Write sim's current state into the buffer.
+
+        Raises OverflowError, leaving the buffer as it was, if any value
+        doesn't fit in 64 bits (e.g., an architecture whose registers are
+        unbounded Python ints).
+        """
+        # Convert everything first, so an OverflowError comes before any writes
+        regs = array("q", sim.regfile)
+        buttons = array("q", sim.buttons)
+        matrix = array("q", [val for row in sim.matrix for val in row])
+        dmem = sim.dmem
+        published = self._published
+        blocks = []  # (block index, start, words) of the blocks that changed
+        if dmem != published:
+            if len(published) != len(dmem):
+                published = [None] * len(dmem)  # nothing published yet, so every block differs
+            block = self.BLOCK
+            for i, start in enumerate(range(0, len(dmem), block)):
+                words = dmem[start:start + block]
+                if words != published[start:start + block]:
+                    blocks.append((i, start, array("q", words)))
+
+        values = self.values
+        seq = values[_SEQ] + 1
+        values[_SEQ] = seq  # odd: writing
+        values[_PC] = sim.PC
+        values[self._regs:self._buttons] = regs
+        values[self._buttons:self._matrix] = buttons
+        values[self._matrix:self._stamps] = matrix
+        for i, start, words in blocks:
+            values[self._dmem + start:self._dmem + start + len(words)] = words
+            values[self._stamps + i] = seq + 1
+        values[_SEQ] = seq + 1
+        if blocks:
+            self._published = dmem[:]
+
+    def read(self, sim, last_seq: int) -> int | None:
+        """ Copy the state into sim if it has been published since last_seq.
+            Only DMEM blocks written after last_seq are copied.
+
+        Returns the seq of the state read, or None if nothing is new.
+        """
+        values = self.values
+        block = self.BLOCK
+        while True:
+            seq = values[_SEQ]
+            if seq == last_seq:
+                return None
+            if seq & 1:
+                time.sleep(0)  # the simulator is mid-publish
+                continue
+            sim.PC = values[_PC]
+            sim.regfile[:] = values[self._regs:self._buttons].tolist()
+            sim.buttons[:] = values[self._buttons:self._matrix].tolist()
+            flat = values[self._matrix:self._stamps].tolist()
+            size = len(sim.matrix)
+            for row in range(size):
+                sim.matrix[row][:] = flat[row * size:(row + 1) * size]
+            for i in range(self._dmem - self._stamps):
+                if values[self._stamps + i] > last_seq:
+                    start = i * block
+                    end = min(start + block, len(sim.dmem))
+                    sim.dmem[start:end] = values[self._dmem + start:self._dmem + end].tolist()
+            if values[_SEQ] == seq:
+                return seq
+
+    def close(self, unlink: bool = False) -> None:
+        self.values.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RenderProcess:
+    """ A process drawing a Simulator's state, as published by publish(), at
+        up to fps frames per second, until close().  Usable as a context
+        manager.
+    """
+    def __init__(self, sim, fps: int) -> None:
+        import print_utils
+
+        self.state = SharedState(sim)
+        try:
+            self.state.publish(sim)
+            self._stop = multiprocessing.Event()
+            # The renderer sends its memory cache back over this when done
+            self._cache_in, cache_out = multiprocessing.Pipe(duplex=False)
+            self.process = multiprocessing.Process(
+                target=_render_loop,
+                args=(self.state.name, type(sim).__module__, sim.imem, fps, self._stop,
+                      print_utils._mem_cache, cache_out),
+                daemon=True,
+            )
+            self.process.start()
+            cache_out.close()  # only the renderer writes to it
+        except BaseException:
+            self.state.close(unlink=True)
+            raise
+
+    def publish(self, sim) -> None:
+        self.state.publish(sim)
+
+    def close(self) -> None:
+        """ Stop the process, once it has drawn the last state published. """
+        import print_utils
+
+        self._stop.set()
+        try:
+            print_utils._mem_cache.update(self._cache_in.recv())
+        except EOFError:
+            pass  # the renderer died without sending it
+        self.process.join()
+        self.state.close(unlink=True)
+
+    def __enter__(self) -> "RenderProcess":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _render_loop(
+    name: str,
+    arch_module: str,
+    imem: list[int],
+    fps: int,
+    stop,
+    mem_cache: dict,
+    cache_out
+) -> None:
+    # A Simulator of the same architecture, with the same program, just to
+    # hold the published state and print() it
+    import print_utils
+
+    print_utils._mem_cache.update(mem_cache)
+    sim = importlib.import_module(arch_module).Simulator()
+    sim.load_imem(imem)
+    state = SharedState(sim, name)
+    seq = 0
+    try:
+        while True:
+            stopping = stop.is_set()
+            new_seq = state.read(sim, seq)
+            if new_seq is not None:
+                seq = new_seq
+                print("[2J[H")  # clear the screen and return to home position
+                sim.print()
+            if stopping:
+                break
+            time.sleep(1 / fps)
+    finally:
+        state.close()
+        cache_out.send(print_utils._mem_cache)
+        cache_out.close()
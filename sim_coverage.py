@@ -0,0 +1,169 @@
+#!/bin/env python3
+#
+# sim_coverage.py  --  Instruction and branch coverage for 256sim programs.
+#
+# Author: Mark Liffiton
+#
+
+
+class Coverage:
+    """ Which IMEM addresses have executed, and which way they went.
+
+    Two flags are kept per address, one byte each while simulating and
+    packed into bitmaps when saved:
+     - fallthrough[addr]: the instruction executed without branching or jumping
+     - taken[addr]: the instruction executed and branched or jumped
+    For a conditional branch, those are exactly "not taken" and "taken", even
+    for a branch to addr+1 (decided by the architecture's branch_condition();
+    without one, such a branch only ever counts as not taken).
+
+    Coverage from different runs of the same program (including runs in other
+    processes; Coverage objects pickle) can be combined with merge().
+    """
+    def __init__(self, imem: list[int]) -> None:
+        self.program = program_id(imem)
+        self.fallthrough = bytearray(len(imem))
+        self.taken = bytearray(len(imem))
+
+    def __len__(self) -> int:
+        return len(self.fallthrough)
+
+    def executed(self, addr: int) -> bool:
+        return bool(self.fallthrough[addr] or self.taken[addr])
+
+    def merge(self, other: "Coverage") -> None:
+        """ Add all coverage from other (of the same program) into this. """
+        if other.program != self.program:
+            raise ValueError("Cannot merge coverage from two different programs.")
+        self.fallthrough = bytearray(a | b for a, b in zip(self.fallthrough, other.fallthrough))
+        self.taken = bytearray(a | b for a, b in zip(self.taken, other.taken))
+
+    def summary(self, branch_addrs: list[int]) -> dict:
+        """ Count covered instructions and branch directions.
+
+        Parameters:
+         - branch_addrs: list of the IMEM addresses holding conditional branches
+        """
+        return {
+            "instructions": len(self),
+            "executed": sum(1 for addr in range(len(self)) if self.executed(addr)),
+            "branches": len(branch_addrs),
+            "branches_taken": sum(self.taken[addr] for addr in branch_addrs),
+            "branches_not_taken": sum(self.fallthrough[addr] for addr in branch_addrs),
+            "branches_both_ways": sum(self.taken[addr] & self.fallthrough[addr] for addr in branch_addrs),
+        }
+
+    def save(self, filename: str) -> None:
+        import json
+
+        data = {
+            "program": self.program,
+            "length": len(self),
+            "fallthrough": _pack(self.fallthrough),
+            "taken": _pack(self.taken),
+        }
+        with open(filename, "w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, filename: str) -> "Coverage":
+        import json
+
+        with open(filename, "r") as f:
+            data = json.load(f)
+        cov = cls([])
+        cov.program = data["program"]
+        cov.fallthrough = _unpack(data["fallthrough"], data["length"])
+        cov.taken = _unpack(data["taken"], data["length"])
+        return cov
+
+    def annotate(self, asm_lines: list[str], branch_addrs: list[int]) -> list[str]:
+        """ Annotate assembly source with coverage, one output line per input line.
+
+        Every line holding an instruction (i.e., not blank, a comment, or just
+        a label) is taken to be the next IMEM address, in order.  Each is
+        prefixed with its address and either '#####' if it never executed or
+        '+' if it did; conditional branches also show whether they were
+        [T]aken and/or [N]ot taken.
+        """
+        branches = set(branch_addrs)
+        out = []
+        addr = 0
+        for line in asm_lines:
+            line = line.rstrip("\n")
+            code = line.split("#")[0]
+            if ":" in code:
+                code = code.split(":", 1)[1]  # drop a label
+            if not code.strip() or addr >= len(self):
+                out.append(f"{'':4}  {'':5}  {'':5} | {line}")
+                continue
+
+            mark = "+" if self.executed(addr) else "#####"
+            dirs = ""
+            if addr in branches:
+                dirs = "[" + ("T" if self.taken[addr] else "-") + ("N" if self.fallthrough[addr] else "-") + "]"
+            out.append(f"{addr:4x}  {mark:>5}  {dirs:5} | {line}")
+            addr += 1
+        return out
+
+
+def program_id(imem: list[int]) -> str:
+    """ Identify a program by a hash of its machine code. """
+    import hashlib  # only needed with coverage enabled, and slow to import
+    return hashlib.sha1(" ".join(f"{word:x}" for word in imem).encode()).hexdigest()
+
+
+def _pack(flags: bytearray) -> str:
+    # One bit per address, address 0 in the least significant bit, as hex
+    return f"{sum(1 << addr for addr, flag in enumerate(flags) if flag):x}"
+
+
+def _unpack(packed: str, length: int) -> bytearray:
+    bits = int(packed, 16)
+    return bytearray((bits >> addr) & 1 for addr in range(length))
+
+
+def main() -> None:
+    import argparse
+    import importlib
+
+    parser = argparse.ArgumentParser(description="Combine and report coverage files written by 256sim.py --coverage.")
+    parser.add_argument("architecture", help="architecture name (as for 256sim.py)")
+    parser.add_argument("binfile", help="machine code the coverage was collected on")
+    parser.add_argument("covfiles", nargs="+", help="coverage files to merge")
+    parser.add_argument("-o", "--output", help="also write the merged coverage to this file")
+    parser.add_argument("--asm", help="assembly source to annotate (default: binfile with .asm suffix, or the disassembly if that doesn't exist)")
+    parser.add_argument("--listing", help="write the annotated listing here (default: the .asm path + '.cov')")
+    args = parser.parse_args()
+
+    arch = importlib.import_module(f"archs.{args.architecture}")
+    sim = arch.Simulator()
+    sim.load_bin(args.binfile)
+
+    cov = Coverage(sim.imem)
+    for covfile in args.covfiles:
+        cov.merge(Coverage.load(covfile))
+    if args.output:
+        cov.save(args.output)
+
+    branch_addrs = sim.branch_addrs()
+    for key, val in cov.summary(branch_addrs).items():
+        print(f"{key}: {val}")
+
+    asm = args.asm or args.binfile.rsplit(".", 1)[0] + ".asm"
+    listing = args.listing or asm + ".cov"
+    try:
+        with open(asm, "r") as f:
+            asm_lines = f.readlines()
+    except FileNotFoundError:
+        # No source; annotate the disassembly instead
+        print(f"{asm} not found; annotating disassembly.")
+        asm_lines = [sim.disassembly(addr) for addr in range(len(sim.imem))]
+    annotated = cov.annotate(asm_lines, branch_addrs)
+    with open(listing, "w") as f:
+        f.write("\n".join(annotated) + "\n")
+    print(f"Annotated listing written to {listing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#
+# sim_stats.py  --  Runtime statistics for a 256sim Simulator.
+#
+# Authors: Mark Liffiton
+#
+from memory_bus import MemoryBus
+
+
+class SimStats:
+    """ Running totals for one Simulator, kept from its creation onward.
+
+    Memory traffic is counted live by each MemoryBus; since a bus is rebuilt
+    on every reset, its counts are folded in here by retire_bus() first.
+    """
+    def __init__(self) -> None:
+        self.cycles = 0
+        self.resets = 0
+        self.step_seconds = 0.0     # time spent inside the run loop
+        self.render_seconds = 0.0   # time spent printing the state
+        self.last_run_cycles = 0
+        self.last_run_seconds = 0.0
+        self.mem_reads = 0          # all bus reads/writes, devices included
+        self.mem_writes = 0
+        self.device_accesses: dict[str, list[int]] = {}
+
+    def retire_bus(self, bus: MemoryBus) -> None:
+        """ Add a bus's counts into the totals before it is discarded. """
+        self.mem_reads += bus.accesses[0]
+        self.mem_writes += bus.accesses[1]
+        _add_device_counts(self.device_accesses, bus.device_accesses)
+
+    def as_dict(self, live_buses: list[MemoryBus]) -> dict:
+        """ Return all statistics as a JSON-friendly dict, including the
+            counts of the buses currently in use.
+        """
+        mem_reads = self.mem_reads + sum(bus.accesses[0] for bus in live_buses)
+        mem_writes = self.mem_writes + sum(bus.accesses[1] for bus in live_buses)
+        device_accesses: dict[str, list[int]] = {}
+        _add_device_counts(device_accesses, self.device_accesses)
+        for bus in live_buses:
+            _add_device_counts(device_accesses, bus.device_accesses)
+
+        devices = {
+            name: {"reads": reads, "writes": writes}
+            for name, (reads, writes) in sorted(device_accesses.items())
+        }
+        io_reads = sum(reads for reads, _ in device_accesses.values())
+        io_writes = sum(writes for _, writes in device_accesses.values())
+        ips = self.last_run_cycles / self.last_run_seconds if self.last_run_seconds else 0.0
+
+        return {
+            "cycles": self.cycles,
+            "last_run": {
+                "cycles": self.last_run_cycles,
+                "seconds": self.last_run_seconds,
+                "ips": ips,
+            },
+            "dmem_reads": mem_reads - io_reads,
+            "dmem_writes": mem_writes - io_writes,
+            "io_reads": io_reads,
+            "io_writes": io_writes,
+            "matrix_updates": devices.get("matrix", {}).get("writes", 0),
+            "devices": devices,
+            "resets": self.resets,
+            "step_seconds": self.step_seconds,
+            "render_seconds": self.render_seconds,
+        }
+
+
+def _add_device_counts(totals: dict[str, list[int]], device_accesses: dict[str, list[int]]) -> None:
+    for name, (reads, writes) in device_accesses.items():
+        counts = totals.setdefault(name, [0, 0])
+        counts[0] += reads
+        counts[1] += writes
@@ -0,0 +1,594 @@
+#
+# simulator_base.py  --  Common Simulator base class for 256sim architectures.
+#
+# Authors: Mark Liffiton
+#
+from call_memo import CallMemo
+from delay_loops import find_delay_loops
+from memory_bus import MemoryBus
+from sim_coverage import Coverage, program_id
+from sim_stats import SimStats
+from timing import Profile, TimingModel
+from traps import Trap, TrapInterrupted, TrapResult
+
+from collections.abc import Callable, Iterable
+import functools
+import itertools
+import operator
+import time
+
+# A decoded instruction: (mnemonic, field_a, field_b).  Unused fields are 0,
+# and a word that doesn't decode to any instruction has a mnemonic of None.
+Instruction = tuple[str | None, int, int]
+
+# An instruction handler takes the (already incremented) PC and the two
+# decoded fields, executes the instruction, and returns the next PC.
+Handler = Callable[[int, int, int], int]
+
+# The run loop's placeholder for an instruction that has a trap
+_TRAP_OP = "<trap>"
+
+
+class _Trapped(Exception):
+    """ Raised by the placeholder instruction, to leave the run loop. """
+
+
+def _trapped(pc: int, a: int, b: int) -> int:
+    raise _Trapped
+
+
+def _run_normally(sim: "BaseSimulator", budget: int | None, stops: frozenset[int]) -> None:
+    # A trap that only sends its instruction through _take_trap(), so
+    # _taken() can tell whether it jumped
+    return None
+
+
+# Conditions branch_condition() can return
+_COMPARE = {"==": operator.eq, "!=": operator.ne, ">": operator.gt}
+
+
+class BaseSimulator:
+    """ Machinery shared by every architecture's Simulator.
+
+    An architecture subclasses this, sets the size constants below, and
+    implements two methods:
+     - decode(word): split one machine code word into an Instruction.
+     - _make_handlers(): build the dispatch table mapping each mnemonic to
+                         its Handler.
+    Loading, resetting, buttons, printing, and the run loop all live here.
+    Architectures with memory-mapped devices override _make_bus() as well.
+    """
+    NUMREG = 1           # number of registers in the register file
+    REGSIZE = 8          # size (in bits) of each register
+    ADDRSIZE = 1         # size (in bits) of DMEM addresses
+    NUMBUTTONS = 1       # Number of buttons (binary on/off) for input
+    MATRIXSIZE = 1       # width and height of the pixel matrix output
+    DMEM_START = 0       # lowest DMEM address shown by print()
+    WATCH_INTERVAL = 100 # cycles between screen updates in watch_n()
+    RENDER_SLICE = 10_000  # cycles run between frame checks when rendering in another process
+    IMEM_WINDOW = (4, 8) # instructions print() shows before and after the PC
+    BRANCH_OPS: frozenset[str] = frozenset()  # mnemonics of conditional branches
+    CALL_OPS: frozenset[str] = frozenset()    # mnemonics of subroutine calls (returning to addr+1)
+    RANDOM_OPS: frozenset[str] = frozenset()  # mnemonics that use random numbers
+    TIMING = TimingModel()  # hardware timing, if enabled (see timing.py)
+    REG_MODULUS: int | None = None  # registers wrap modulo this (None: they don't)
+    FAST_LOOPS = True    # skip through counted delay loops (see delay_loops.py)
+
+    def __init__(self) -> None:
+        # CPU state:
+        self.imem: list[int] = [0]  # not affected by CPU reset, so only initialized here
+        # Simulator state (separate from the CPU itself):
+        self.bin_filename: str = ""
+        self._decoded: list[Instruction] = [self.decode(0)]
+        self._disasm: list[str | None] = [None]  # filled in as needed by disassembly()
+        self._stats = SimStats()
+        self.coverage: Coverage | None = None  # see enable_coverage()
+        self.profile: Profile | None = None    # see enable_timing()
+        self.timing_model: TimingModel = self.TIMING
+        self.fast_loops: bool = self.FAST_LOOPS  # see set_fast_loops()
+        self.render_fps: int | None = None  # if set, watch_n() draws from a separate process
+        self.memo: CallMemo | None = None   # see enable_memo()
+        self._traps: dict[int, Trap] = {}
+        self._jumps_to_next: frozenset[int] = frozenset()  # see _taken()
+        self._code: list[Instruction] = self._decoded  # _decoded with traps in place
+
+        # Initialize most state using .reset()
+        self.reset()
+        self._stats.resets = 0  # the power-on reset doesn't count
+
+    def load_bin(self, filename: str) -> None:
+        """ Load machine code from a file into instruction memory.
+
+        Parameters:
+         - filename: String of a path to a file containing machine code for
+                     instruction memory.  Machine code words should be written
+                     in hexadecimal, separated by whitespace.
+        """
+        with open(filename, "r") as f:
+            data = f.read()
+        words = data.split()
+        self.load_imem([int(word, 16) for word in words])
+        self.bin_filename = filename
+
+    def load_imem(self, words: list[int]) -> None:
+        """ Load machine code words into instruction memory, as load_bin()
+            does from a file.
+        """
+        self.bin_filename = ""
+        self.imem = list(words)
+        # Decode every word once up front so the run loop never has to
+        self._decoded = [self.decode(word) for word in self.imem]
+        self._disasm = [None] * len(self.imem)
+        if self.coverage is not None:
+            self.coverage = Coverage(self.imem)
+        if self.profile is not None:
+            self.profile = Profile(len(self.imem))
+        if self.memo is not None:
+            self.memo = CallMemo(self.memo.capacity, self.memo.max_cycles)
+        self._install_traps()
+
+        # Always reset on loading new code
+        self.reset()
+
+    def reset(self) -> None:
+        """ Reset the CPU state to just-powered-on, with everything but IMEM cleared. """
+        for bus in self._buses():
+            self._stats.retire_bus(bus)
+        self._stats.resets += 1
+
+        self.PC: int = 0
+        self.regfile: list[int] = [0] * self.NUMREG
+        self.dmem: list[int] = [0] * 2 ** self.ADDRSIZE
+        self.buttons: list[int] = [0] * self.NUMBUTTONS
+        self.matrix: list[list[int]] = [([0] * self.MATRIXSIZE) for _ in range(self.MATRIXSIZE)]
+        # Devices hold on to the lists above, so the bus is rebuilt along with them
+        self.bus: MemoryBus = self._make_bus()
+
+    def change_buttons(self, new_buttons: str) -> None:
+        """ Change the state of the simulated buttons.
+
+        Parameters:
+         - new_buttons: String containing a 0 or 1 for each button
+                        e.g. "0110" for the first button not pressed, the
+                        second and third pressed, and the fourth not pressed.
+        """
+        buttonvals = [int(c) for c in new_buttons]
+        if len(buttonvals) != self.NUMBUTTONS:
+            raise Exception(
+                f"Incorrect number of buttons.  Got {len(buttonvals)}, expected {self.NUMBUTTONS}."
+            )
+        if max(buttonvals) > 1 or min(buttonvals) < 0:
+            raise Exception("Invalid value for button.  Only allowed values are 0 and 1.")
+        # Update in place, as the bus may be reading the buttons list directly
+        self.buttons[:] = buttonvals
+
+    def step(self) -> None:
+        """ Simulate *one* cycle of the CPU (Fetch-Decode-Execute). """
+        self.run(1)
+
+    def step_n(self, n: int) -> None:
+        """ Simulate n cycles of the CPU. """
+        self.run(n)
+
+    def watch_n(self, n: int) -> None:
+        """ Simulate n cycles of the CPU, as in step_n(), but watch the
+            state of the CPU by printing every WATCH_INTERVAL cycles.
+
+            If render_fps is set, the state is instead published to a
+            RenderProcess (see render_process.py) that draws it at up to that
+            many frames per second, while the simulation runs at full speed.
+        """
+        stats = self._stats
+        start_cycles, start_seconds = stats.cycles, stats.step_seconds
+        done = self._watch_rendered(n) if self.render_fps else 0
+        for i in range(done, n, self.WATCH_INTERVAL):
+            self.run(1)
+            print("[2J[H")  # clear the screen and return to home position
+            self.print()
+            time.sleep(0.05)
+            self.run(min(self.WATCH_INTERVAL, n - i) - 1)
+        # Report the watch as a whole, not just its last chunk
+        stats.last_run_cycles = stats.cycles - start_cycles
+        stats.last_run_seconds = stats.step_seconds - start_seconds
+
+    def _watch_rendered(self, n: int) -> int:
+        # Run up to n cycles in RENDER_SLICE pieces, publishing the state to
+        # a RenderProcess about render_fps times a second.  Returns the cycles
+        # run, which is less than n only if the state stopped fitting in the
+        # renderer's 64-bit buffer, so the rest must be printed in-process.
+        from render_process import RenderProcess
+        try:
+            renderer = RenderProcess(self, self.render_fps)
+        except OverflowError:
+            return 0
+        interval = 1 / self.render_fps
+        next_frame = time.perf_counter() + interval
+        done = 0
+        try:
+            while done < n:
+                done += self.run(min(self.RENDER_SLICE, n - done))
+                if time.perf_counter() >= next_frame:
+                    renderer.publish(self)
+                    next_frame = time.perf_counter() + interval
+            renderer.publish(self)
+        except OverflowError:
+            pass
+        finally:
+            renderer.close()
+        return done
+
+    def run_until(self, pc_breakpoint: int) -> None:
+        """ Simulate until the given breakpoint is reached.
+
+        Parameters:
+         - pc_breakpoint: int of the address at which execution should stop
+        """
+        self.run(until=pc_breakpoint)
+
+    def run(self, n: int | None = None, until: int | Iterable[int] | None = None) -> int:
+        """ Simulate up to n cycles of the CPU, stopping early if the PC
+            reaches until (an address or a collection of them).  At least one
+            cycle is always executed before checking until, so repeatedly
+            running to the same instruction works.  If n is None, run with no
+            limit until reaching until.
+
+        Returns the number of cycles executed.
+        """
+        if n is None and until is None:
+            raise ValueError("run() needs a cycle count, a breakpoint, or both.")
+
+        # Hoist everything the loop touches into locals; the handlers
+        # themselves close over regfile, dmem, etc.
+        code = self._code
+        handlers = self._make_handlers()
+        handlers[_TRAP_OP] = _trapped
+        stops = frozenset([until] if isinstance(until, int) else until or ())
+        instrumented = self.coverage is not None or self.profile is not None
+        counts = jumps = None
+        if instrumented:
+            # Count executions and jumps per address for this run, to be
+            # added into the coverage and/or profile afterward
+            counts = [0] * len(code)
+            jumps = [0] * len(code)
+        pc = self.PC
+        i = 0
+        start = time.perf_counter()
+        try:
+            # Each pass runs until the end or until reaching a trap, which
+            # is handled outside of the loop before picking up where it left off
+            while True:
+                steps = range(i, n) if n is not None else itertools.count(i)
+                try:
+                    if instrumented:
+                        for i in steps:
+                            op, a, b = code[pc]
+                            next_pc = pc + 1
+                            new_pc = handlers[op](next_pc, a, b)
+                            counts[pc] += 1
+                            if new_pc != next_pc:
+                                jumps[pc] += 1
+                            pc = new_pc
+                            if pc in stops:
+                                i += 1
+                                break
+                        else:
+                            i = n
+                    elif until is None:
+                        for i in steps:
+                            op, a, b = code[pc]
+                            pc = handlers[op](pc + 1, a, b)
+                        i = n
+                    else:
+                        for i in steps:
+                            op, a, b = code[pc]
+                            pc = handlers[op](pc + 1, a, b)
+                            if pc in stops:
+                                i += 1
+                                break
+                        else:
+                            i = n
+                    break
+                except _Trapped:
+                    try:
+                        pc, i = self._take_trap(pc, i, n, stops, handlers, counts, jumps)
+                    except TrapInterrupted as e:
+                        # Stop where the error happened, as if run normally
+                        pc, i = self._count_trap(e.result, i, counts, jumps)
+                        raise e.error from None
+                    if i == n or pc in stops:
+                        break
+        finally:
+            self.PC = pc
+            elapsed = time.perf_counter() - start
+            if instrumented:
+                self._record_counts(counts, jumps)
+            stats = self._stats
+            stats.cycles += i
+            stats.step_seconds += elapsed
+            stats.last_run_cycles = i
+            stats.last_run_seconds = elapsed
+        return i
+
+    def _take_trap(
+        self,
+        pc: int,
+        i: int,
+        n: int | None,
+        stops: frozenset[int],
+        handlers: dict[str | None, Handler],
+        counts: list[int] | None,
+        jumps: list[int] | None
+    ) -> tuple[int, int]:
+        # Run the trap at pc (or just its instruction, if it declines) for
+        # run(), returning the new PC and cycle count
+        result = self._traps[pc](self, n - i if n is not None else None, stops)
+        if result is None:
+            op, a, b = self._decoded[pc]
+            new_pc = handlers[op](pc + 1, a, b)
+            result = new_pc, 1, [(pc, 1, int(self._taken(pc, new_pc)))]
+        return self._count_trap(result, i, counts, jumps)
+
+    def _count_trap(
+        self,
+        result: TrapResult,
+        i: int,
+        counts: list[int] | None,
+        jumps: list[int] | None
+    ) -> tuple[int, int]:
+        # Add what a trap did into run()'s counts, returning the new PC and
+        # cycle count
+        new_pc, cycles, executed = result
+        if counts is not None and jumps is not None:
+            for addr, count, taken in executed:
+                counts[addr] += count
+                jumps[addr] += taken
+        return new_pc, i + cycles
+
+    def _taken(self, addr: int, new_pc: int) -> bool:
+        """ Return whether the instruction at addr, just executed and leaving
+            the PC at new_pc, branched or jumped.  Usually that's just whether
+            new_pc isn't addr+1, but a branch or jump to addr+1 lands there
+            either way, so its branch_condition() decides (an unconditional
+            jump always jumps).
+        """
+        if addr in self._jumps_to_next:
+            condition = self.branch_condition(self._decoded[addr])
+            if condition is None:
+                return True
+            reg, cond, other = condition
+            return _COMPARE[cond](self.regfile[reg], self.regfile[other])
+        return new_pc != addr + 1
+
+    def set_fast_loops(self, enabled: bool) -> None:
+        """ Turn skipping through counted delay loops on or off (it's on by
+            default).  The results are the same either way, cycle counts
+            included; turning it off only makes such loops slower.
+        """
+        self.fast_loops = enabled
+        self._install_traps()
+
+    def _install_traps(self) -> None:
+        # Find the traps for the loaded program and put placeholders for
+        # them into the code the run loop executes
+        traps: dict[int, Trap] = {}
+        # Branches and jumps to the next address: conditional branches whose
+        # condition is known, and unconditional jumps
+        self._jumps_to_next = frozenset(
+            addr for addr, instr in enumerate(self._decoded)
+            if self.jump_target(addr, instr) == addr + 1
+            and (instr[0] not in self.BRANCH_OPS or self.branch_condition(instr) is not None)
+        )
+        if self.coverage is not None or self.profile is not None:
+            # The run loop can't tell whether those jumped, so they're run
+            # through _take_trap() to be counted
+            for addr in self._jumps_to_next:
+                traps[addr] = _run_normally
+        if self.fast_loops:
+            for loop in find_delay_loops(self):
+                traps[loop.head] = loop.fast_forward
+        if self.memo is not None:
+            for addr, (op, _, _) in enumerate(self._decoded):
+                if op in self.CALL_OPS:
+                    traps[addr] = functools.partial(self.memo.call, addr)
+        self._traps = traps
+        if traps:
+            self._code = [(_TRAP_OP, 0, 0) if addr in traps else instr for addr, instr in enumerate(self._decoded)]
+        else:
+            self._code = self._decoded
+
+    def enable_memo(self, capacity: int = 1024) -> None:
+        """ Start memoizing subroutine calls (see call_memo.py): a call made
+            again with the same inputs is replayed rather than executed,
+            with the same results and cycle counts.  Up to capacity calls are
+            remembered.  The hits and misses are reported in stats().
+        """
+        self.memo = CallMemo(capacity)
+        self._install_traps()
+
+    def enable_coverage(self, coverage: Coverage | None = None) -> Coverage:
+        """ Start recording coverage of the loaded program (see sim_coverage.py).
+            Coverage is recorded into the given Coverage, if any, so it can
+            accumulate across runs and resets; otherwise into a new one.
+            Loading a new program starts a new Coverage.
+        """
+        if coverage is None:
+            coverage = Coverage(self.imem)
+        elif coverage.program != program_id(self.imem):
+            raise ValueError("Coverage is for a different program.")
+        self.coverage = coverage
+        self._install_traps()
+        return coverage
+
+    def enable_timing(self, model: TimingModel | None = None) -> None:
+        """ Start profiling the loaded program to estimate its timing on real
+            hardware (see timing.py), using the given model or the
+            architecture's default.  The estimate is reported in stats().
+        """
+        if model is not None:
+            self.timing_model = model
+        self.profile = Profile(len(self.imem))
+        self._install_traps()
+
+    def timing(self) -> dict | None:
+        """ Return the hardware timing estimate for everything run since
+            enable_timing(), or None if timing isn't enabled.
+        """
+        if self.profile is None:
+            return None
+        return self.timing_model.report(self, self.profile)
+
+    def _record_counts(self, counts: list[int], jumps: list[int]) -> None:
+        # Add one run's execution counts into the coverage and/or profile
+        if self.coverage is not None:
+            fallthrough = self.coverage.fallthrough
+            taken = self.coverage.taken
+            for addr, count in enumerate(counts):
+                if count:
+                    if count > jumps[addr]:
+                        fallthrough[addr] = 1
+                    if jumps[addr]:
+                        taken[addr] = 1
+        if self.profile is not None:
+            self.profile.add(counts, jumps)
+
+    def branch_addrs(self) -> list[int]:
+        """ Return the IMEM addresses of all conditional branches. """
+        return [addr for addr, (op, _, _) in enumerate(self._decoded) if op in self.BRANCH_OPS]
+
+    def halt_addrs(self) -> list[int]:
+        """ Return the IMEM addresses of instructions that jump to themselves.
+            Once one of those jumps is taken, nothing can change any more, so
+            the program has effectively halted there.
+        """
+        return [addr for addr, instr in enumerate(self._decoded) if self.jump_target(addr, instr) == addr]
+
+    def stats(self) -> dict:
+        """ Return runtime statistics as a JSON-friendly dict: total cycles,
+            instructions per second over the last run, DMEM and I/O traffic,
+            LED matrix updates, resets, and time spent simulating vs. printing.
+        """
+        stats = self._stats.as_dict(self._buses())
+        if self.profile is not None:
+            stats["timing"] = self.timing()
+        if self.memo is not None:
+            stats["memo"] = self.memo.stats()
+        return stats
+
+    def stats_json(self) -> str:
+        """ Return stats() formatted as JSON. """
+        import json
+        return json.dumps(self.stats(), indent=2)
+
+    def _buses(self) -> list[MemoryBus]:
+        # Every bus the architecture has set up, wherever it keeps them
+        return [val for val in vars(self).values() if isinstance(val, MemoryBus)]
+
+    def print(self) -> None:
+        """ Print the current state of all state (memory) elements of the CPU. """
+        # Imported here, so only programs that display anything pay for it
+        from print_utils import print_val, print_mem, print_disasm, print_input, print_matrix
+        start = time.perf_counter()
+        print_val(self.PC, "PC")
+        # Only a window of IMEM around the PC, so large programs print as fast as small ones
+        before, after = self.IMEM_WINDOW
+        window = range(max(self.PC - before, 0), min(self.PC + after + 1, len(self.imem)))
+        print_disasm([(addr, self.imem[addr], self.disassembly(addr)) for addr in window], "IMEM", highlight=self.PC)
+        print_mem(self.regfile, "Regfile", val_width=self.REGSIZE, label_all=True)
+        print_mem(self.dmem, "DMEM", val_width=self.REGSIZE, min_addr=self.DMEM_START, limit_to_modified=True)
+        print_input(self.buttons, "Input")
+        print_matrix(self.matrix, "Output")
+        self._stats.render_seconds += time.perf_counter() - start
+
+    def disassembly(self, addr: int) -> str:
+        """ Return the assembly for the instruction at addr in IMEM (cached). """
+        text = self._disasm[addr]
+        if text is None:
+            text = self._disasm[addr] = self.disassemble(addr, self._decoded[addr])
+        return text
+
+    def disassemble(self, addr: int, instr: Instruction) -> str:
+        """ Return assembly for the given decoded instruction, located at addr.
+            Architectures should override this to match their assembly syntax;
+            by default the mnemonic and raw fields are shown.
+        """
+        op, a, b = instr
+        if op is None:
+            return f".word {self.imem[addr]:#06x}"
+        return f"{op} {a} {b}"
+
+    def decode(self, word: int) -> Instruction:
+        """ Decode one machine code word into (mnemonic, field_a, field_b).
+            Immediates should be returned already sign-extended.
+        """
+        raise NotImplementedError
+
+    def encode(self, instr: Instruction) -> int:
+        """ Encode a decoded instruction back into its machine code word (the
+            inverse of decode()).  Used to generate programs (see stress.py).
+        """
+        raise NotImplementedError
+
+    def random_instruction(self, op: str, rng, addr: int, length: int, footprint: int) -> Instruction:
+        """ Return a random instance of the instruction op, to be placed at
+            addr in a generated program of the given length (see stress.py).
+            It must be safe to run with whatever is in the registers then:
+            branches and jumps stay within the program, and memory and I/O
+            accesses stay within valid addresses, using at most footprint
+            words of DMEM.  Typically some registers are set aside to hold
+            addresses, and only written with valid ones.
+        """
+        raise NotImplementedError(f"No random instructions for {op}.")
+
+    def jump_to_start(self, addr: int) -> Instruction:
+        """ Return an instruction for addr that always jumps to address 0,
+            to end a generated program (see stress.py).
+        """
+        raise NotImplementedError
+
+    def reg_access(self, instr: Instruction) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        """ Return the registers the given instruction reads and the
+            registers it writes, as (reads, writes).  Used for static analysis
+            of programs.
+        """
+        return (), ()
+
+    def jump_target(self, addr: int, instr: Instruction) -> int | None:
+        """ Return the address the given instruction (located at addr) jumps
+            or branches to when taken, if it does and that can be known
+            without running it.  Used for static analysis of programs.
+        """
+        return None
+
+    def counter_update(self, instr: Instruction) -> tuple[int, int, int | None, int] | None:
+        """ If the given instruction only adds to one register, by a constant
+            and/or a multiple of another register, return (reg, const, src,
+            scale): it sets reg += const + scale * regfile[src] (with src None
+            if only a constant is added).  Otherwise, return None.  Used to
+            find delay loops (see delay_loops.py).
+        """
+        return None
+
+    def branch_condition(self, instr: Instruction) -> tuple[int, str, int] | None:
+        """ If the given instruction is a conditional branch comparing two
+            registers, return (reg, cond, other): the branch is taken when
+            regfile[reg] cond regfile[other] is true, where cond is one of
+            "==", "!=", or ">".  Otherwise, return None.  Used to find delay
+            loops (see delay_loops.py).
+        """
+        return None
+
+    def _make_bus(self) -> MemoryBus:
+        """ Build the memory bus that load and store instructions go through.
+            By default, every address maps to DMEM.
+        """
+        bus = MemoryBus(self.ADDRSIZE)
+        bus.map_ram(0, len(self.dmem), self.dmem)
+        return bus
+
+    def _make_handlers(self) -> dict[str | None, Handler]:
+        """ Build the dispatch table for the run loop: a Handler for every
+            mnemonic decode() can return, including None.  Called at the
+            start of every run(), so handlers may capture the current
+            regfile, dmem, etc. in closures.
+        """
+        raise NotImplementedError
@@ -0,0 +1,108 @@
+#!/bin/env python3
+#
+# stress.py  --  Generate random (but valid) programs for 256sim architectures.
+#
+# Author: Mark Liffiton
+#
+# Every instruction of a generated program is safe to execute no matter how
+# it's reached: branches and jumps stay inside the program, and loads,
+# stores, and I/O use only valid addresses (see random_instruction() in each
+# architecture).  The last instruction jumps back to the start, so a program
+# can run for any number of cycles.  bench.py uses these to measure the
+# simulator's speed on many different instruction mixes and to soak test it.
+#
+import argparse
+import importlib
+import random
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """ Parse an opcode mix like "load=4,store=4,add=1" into weights. """
+    mix = {}
+    for part in spec.split(","):
+        op, _, weight = part.partition("=")
+        mix[op.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def generate(
+    sim,
+    length: int = 200,
+    mix: dict[str, float] | None = None,
+    branch_density: float = 0.15,
+    footprint: int = 16,
+    seed: int | None = None
+) -> list[int]:
+    """ Generate a random program for sim's architecture.
+
+    Parameters:
+     - sim: a Simulator of the architecture
+     - length: number of instructions
+     - mix: relative weight of each mnemonic (default: all equal); those left
+            out aren't used, and mnemonics the architecture doesn't have are
+            ignored
+     - branch_density: fraction of instructions that are conditional
+                       branches (chosen among the branches by their weights
+                       in mix)
+     - footprint: number of DMEM words loads and stores may use (at most)
+     - seed: seed for the random choices, so a program can be regenerated
+
+    Returns the program's machine code words.
+    """
+    rng = random.Random(seed)
+    ops = sorted(op for op in sim._make_handlers() if op is not None)
+    weights = {op: 1.0 for op in ops} if mix is None else {op: mix.get(op, 0.0) for op in ops}
+    branches = [op for op in ops if op in sim.BRANCH_OPS and weights[op] > 0]
+    others = [op for op in ops if op not in sim.BRANCH_OPS and weights[op] > 0]
+    if not others:
+        raise ValueError(f"The mix has no instructions besides branches (available: {', '.join(ops)}).")
+
+    words = []
+    for addr in range(length - 1):
+        if branches and rng.random() < branch_density:
+            op = rng.choices(branches, [weights[op] for op in branches])[0]
+        else:
+            op = rng.choices(others, [weights[op] for op in others])[0]
+        words.append(_encode(sim, sim.random_instruction(op, rng, addr, length, footprint)))
+    words.append(_encode(sim, sim.jump_to_start(length - 1)))
+    return words
+
+
+def _encode(sim, instr) -> int:
+    # Check each instruction survives the round trip, so a generated program
+    # is exactly what was intended
+    word = sim.encode(instr)
+    if sim.decode(word) != instr:
+        raise ValueError(f"{instr} does not encode correctly (decodes as {sim.decode(word)}).")
+    return word
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a random, valid program for a 256sim architecture.")
+    parser.add_argument("architecture", help="architecture name (as for 256sim.py)")
+    parser.add_argument("output", help="machine code file to write")
+    parser.add_argument("--length", type=int, default=200, help="number of instructions (default: 200)")
+    parser.add_argument("--mix", help="relative weights of mnemonics, e.g. load=4,store=4,add=1 (default: all equal)")
+    parser.add_argument("--branch-density", type=float, default=0.15,
+                        help="fraction of instructions that are conditional branches (default: 0.15)")
+    parser.add_argument("--footprint", type=int, default=16, help="DMEM words that may be used (default: 16)")
+    parser.add_argument("--seed", type=int, help="random seed, to regenerate the same program")
+    parser.add_argument("--asm", action="store_true", help="also write the disassembly to OUTPUT with a .asm suffix")
+    args = parser.parse_args()
+
+    arch = importlib.import_module(f"archs.{args.architecture}")
+    sim = arch.Simulator()
+    mix = parse_mix(args.mix) if args.mix else None
+    words = generate(sim, args.length, mix, args.branch_density, args.footprint, args.seed)
+    with open(args.output, "w") as f:
+        f.write("\n".join(f"{word:04x}" for word in words) + "\n")
+
+    if args.asm:
+        sim.load_imem(words)
+        asm = args.output.rsplit(".", 1)[0] + ".asm"
+        with open(asm, "w") as f:
+            f.write("\n".join(sim.disassembly(addr) for addr in range(len(words))) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/bin/env python3
+#
+# sweep.py  --  Run one program many times over button inputs and RNG seeds.
+#
+# Author: Mark Liffiton
+#
+import argparse
+import collections
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import statistics
+
+from sim_coverage import Coverage
+
+# A button timeline: (cycle, button state) pairs, in order, starting at cycle 0
+Timeline = list[tuple[int, str]]
+
+
+def parse_timeline(spec: str) -> Timeline:
+    """ Parse a button timeline like "0000,1000@200,0000@450": all buttons
+        released at the start, the first pressed at cycle 200, and released
+        again at cycle 450.  A single state like "0100" holds for the whole run.
+    """
+    timeline = []
+    for i, part in enumerate(spec.split(",")):
+        state, _, cycle = part.partition("@")
+        if not cycle and i > 0:
+            raise ValueError(f"Button state '{part}' needs a cycle to start at (e.g., '{state}@1000').")
+        timeline.append((int(cycle) if cycle else 0, state))
+    if timeline[0][0] != 0:
+        timeline.insert(0, (0, "0" * len(timeline[0][1])))
+    if any(a[0] >= b[0] for a, b in zip(timeline, timeline[1:])):
+        raise ValueError(f"Button timeline '{spec}' must list strictly increasing cycles.")
+    return timeline
+
+
+def parse_seeds(spec: str) -> list[int]:
+    """ Parse "START:END" (END excluded), or a comma-separated list of seeds. """
+    if ":" in spec:
+        start, end = spec.split(":")
+        return list(range(int(start), int(end)))
+    return [int(seed) for seed in spec.split(",")]
+
+
+# Each worker process loads the program once and reuses its Simulator
+_sim = None
+_halts: frozenset[int] = frozenset()
+_reported: Coverage | None = None  # coverage the worker has already returned
+
+
+def _init_worker(arch_name: str, binfile: str, coverage: bool) -> None:
+    global _sim, _halts, _reported
+    arch = importlib.import_module(f"archs.{arch_name}")
+    _sim = arch.Simulator()
+    _sim.load_bin(binfile)
+    if coverage:
+        _sim.enable_coverage()
+        _reported = Coverage(_sim.imem)
+    _halts = frozenset(_sim.halt_addrs())
+
+
+def _new_coverage() -> tuple[list[int], list[int]]:
+    # The addresses whose fallthrough and taken flags were set since the
+    # worker last returned its coverage, so each is sent (and merged) once
+    new = []
+    for flags, reported in [
+        (_sim.coverage.fallthrough, _reported.fallthrough),
+        (_sim.coverage.taken, _reported.taken),
+    ]:
+        addrs = [addr for addr, (flag, seen) in enumerate(zip(flags, reported)) if flag and not seen]
+        for addr in addrs:
+            reported[addr] = 1
+        new.append(addrs)
+    return new[0], new[1]
+
+
+def run_one(task: tuple[int, Timeline, int, int]) -> dict:
+    """ Run the worker's program once, from reset, and describe how it ended.
+
+    Parameters:
+     - task: (timeline index, button timeline, RNG seed, maximum cycles)
+    """
+    timeline_index, timeline, seed, max_cycles = task
+    sim = _sim
+    sim.reset()
+    random.seed(seed)
+
+    cycles = 0
+    halted = False
+    error = None
+    next_change = 0
+    try:
+        while cycles < max_cycles:
+            while next_change < len(timeline) and timeline[next_change][0] <= cycles:
+                sim.change_buttons(timeline[next_change][1])
+                next_change += 1
+            limit = timeline[next_change][0] if next_change < len(timeline) else max_cycles
+            cycles += sim.run(min(limit, max_cycles) - cycles, until=_halts)
+            if sim.PC in _halts:
+                # Reached a jump-to-self; it has halted if the jump is taken
+                pc = sim.PC
+                sim.run(1)
+                if sim.PC == pc:
+                    halted = True
+                    break
+                cycles += 1
+    except Exception as e:
+        error = str(e)
+
+    return {
+        "timeline": timeline_index,
+        "seed": seed,
+        "cycles": cycles,
+        "halted": halted,
+        "error": error,
+        "pc": sim.PC,
+        "regfile": tuple(sim.regfile),
+        "matrix": tuple(tuple(row) for row in sim.matrix),
+        "coverage": _new_coverage() if sim.coverage is not None else None,
+    }
+
+
+def summarize(results: list[dict], timelines: list[str], top: int) -> dict:
+    """ Aggregate the results of many runs into distributions. """
+    halt_cycles = [r["cycles"] for r in results if r["halted"]]
+    states = collections.Counter((r["pc"], r["regfile"], r["matrix"]) for r in results)
+    matrices = collections.Counter(r["matrix"] for r in results)
+    errors = collections.Counter(r["error"] for r in results if r["error"])
+
+    per_timeline = []
+    for i, spec in enumerate(timelines):
+        runs = [r for r in results if r["timeline"] == i]
+        per_timeline.append({
+            "buttons": spec,
+            "runs": len(runs),
+            "halted": sum(r["halted"] for r in runs),
+            "distinct_states": len({(r["pc"], r["regfile"], r["matrix"]) for r in runs}),
+        })
+
+    return {
+        "runs": len(results),
+        "halted": len(halt_cycles),
+        "errors": dict(errors),
+        "cycles_to_halt": {
+            "min": min(halt_cycles),
+            "median": statistics.median(halt_cycles),
+            "mean": statistics.mean(halt_cycles),
+            "max": max(halt_cycles),
+        } if halt_cycles else None,
+        "distinct_final_states": len(states),
+        "distinct_matrices": len(matrices),
+        "top_matrices": [
+            {"count": count, "matrix": [list(row) for row in matrix]}
+            for matrix, count in matrices.most_common(top)
+        ],
+        "per_timeline": per_timeline,
+    }
+
+
+def print_summary(summary: dict) -> None:
+    from print_utils import print_head, print_matrix
+
+    print_head("Sweep")
+    print(f"Runs:            {summary['runs']}")
+    print(f"Halted:          {summary['halted']}")
+    for error, count in summary["errors"].items():
+        print(f"Error ({count}x):    {error}")
+    halt = summary["cycles_to_halt"]
+    if halt:
+        print(f"Cycles to halt:  min {halt['min']}, median {halt['median']}, mean {halt['mean']:.1f}, max {halt['max']}")
+    print(f"Distinct final states: {summary['distinct_final_states']}, matrices: {summary['distinct_matrices']}")
+    for entry in summary["per_timeline"]:
+        print(f"  {entry['buttons']}: {entry['runs']} runs, {entry['halted']} halted, {entry['distinct_states']} distinct states")
+    for entry in summary["top_matrices"]:
+        print_matrix(entry["matrix"], f"Final matrix in {entry['count']} runs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a program many times over button inputs and RNG seeds, in parallel.")
+    parser.add_argument("architecture", help="architecture name (as for 256sim.py)")
+    parser.add_argument("binfile")
+    parser.add_argument("--buttons", nargs="+", default=[], metavar="TIMELINE",
+                        help="button states (e.g. 0100) or timelines (e.g. 0000,1000@200,0000@450) to try (default: none pressed)")
+    parser.add_argument("--seeds", default="0:100", help="RNG seeds: START:END or a comma-separated list (default: 0:100)")
+    parser.add_argument("--cycles", type=int, default=100_000, help="maximum cycles per run (default: 100000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, help="runs handed to a worker at a time (default: spread evenly)")
+    parser.add_argument("--top", type=int, default=3, help="number of most common final matrices to show (default: 3)")
+    parser.add_argument("--coverage", metavar="COVFILE", help="merge coverage of all runs into COVFILE")
+    parser.add_argument("--json", metavar="FILE", help="also write the summary to FILE as JSON")
+    args = parser.parse_args()
+
+    # Check everything in this process first, so mistakes are reported once
+    _init_worker(args.architecture, args.binfile, False)
+    specs = args.buttons or ["0" * _sim.NUMBUTTONS]
+    timelines = [parse_timeline(spec) for spec in specs]
+    for timeline in timelines:
+        for _, state in timeline:
+            _sim.change_buttons(state)
+    seeds = parse_seeds(args.seeds)
+
+    tasks = [(i, timeline, seed, args.cycles) for i, timeline in enumerate(timelines) for seed in seeds]
+    workers = max(1, min(args.workers, len(tasks)))
+    chunksize = args.chunksize or max(1, len(tasks) // (workers * 4))
+    initargs = (args.architecture, args.binfile, bool(args.coverage))
+
+    if workers == 1:
+        _init_worker(*initargs)
+        results = [run_one(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers, _init_worker, initargs) as pool:
+            results = list(pool.imap_unordered(run_one, tasks, chunksize))
+
+    summary = summarize(results, specs, args.top)
+    print_summary(summary)
+
+    if args.coverage:
+        try:
+            coverage = Coverage.load(args.coverage)
+        except FileNotFoundError:
+            coverage = Coverage(_sim.imem)
+        swept = Coverage(_sim.imem)
+        for result in results:
+            fallthrough, taken = result["coverage"]
+            for addr in fallthrough:
+                swept.fallthrough[addr] = 1
+            for addr in taken:
+                swept.taken[addr] = 1
+        coverage.merge(swept)
+        coverage.save(args.coverage)
+        print(f"Coverage saved to {args.coverage}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
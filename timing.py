@@ -0,0 +1,105 @@
+#
+# timing.py  --  Simulated-hardware timing for 256sim programs.
+#
+# Authors: Mark Liffiton
+#
+# The simulator itself treats every instruction as one cycle.  The Logisim and
+# breadboard builds of these CPUs don't: loads and stores may take several
+# clock cycles, and a taken branch or jump can cost extra cycles to refill a
+# pipeline.  A TimingModel estimates real clock cycles from a Profile of how
+# often each instruction executed, so it adds nothing to the run loop beyond
+# the counting the Profile needs.
+#
+from collections.abc import Iterable
+
+
+class Profile:
+    """ Per-IMEM-address execution counts. """
+    def __init__(self, length: int) -> None:
+        self.counts = [0] * length  # times the instruction executed
+        self.taken = [0] * length   # times it branched or jumped (see BaseSimulator._taken())
+
+    def add(self, counts: list[int], taken: list[int]) -> None:
+        self.counts = [x + y for x, y in zip(self.counts, counts)]
+        self.taken = [x + y for x, y in zip(self.taken, taken)]
+
+
+class TimingModel:
+    """ Per-instruction latencies plus a simple stall model.
+
+    Parameters:
+     - latencies: dict of clock cycles for each mnemonic that doesn't take
+                  default_latency cycles
+     - default_latency: clock cycles for any other instruction
+     - taken_penalty: extra cycles whenever a branch is taken or a jump made
+                      (e.g., to flush a fetch stage)
+     - load_ops: mnemonics that read memory, for the load-use stall
+     - load_use_penalty: extra cycles when an instruction uses a register
+                         loaded by the instruction just before it
+    """
+    def __init__(
+        self,
+        latencies: dict[str | None, int] | None = None,
+        default_latency: int = 1,
+        taken_penalty: int = 0,
+        load_ops: Iterable[str] = (),
+        load_use_penalty: int = 0
+    ) -> None:
+        self.latencies = latencies or {}
+        self.default_latency = default_latency
+        self.taken_penalty = taken_penalty
+        self.load_ops = frozenset(load_ops)
+        self.load_use_penalty = load_use_penalty
+
+    def report(self, sim, profile: Profile) -> dict:
+        """ Estimate hardware clock cycles for everything in profile.
+
+        Parameters:
+         - sim: the Simulator the profile came from (for its decoded program
+                and its reg_access() and BRANCH_OPS)
+         - profile: execution counts collected while running
+        """
+        code = sim._decoded
+        counts, taken = profile.counts, profile.taken
+
+        instructions = sum(counts)
+        base = 0
+        branch_stalls = 0
+        jump_stalls = 0
+        load_use_stalls = 0
+        by_op: dict[str, int] = {}
+        for addr, count in enumerate(counts):
+            if not count:
+                continue
+            op = code[addr][0]
+            cycles = count * self.latencies.get(op, self.default_latency)
+            base += cycles
+
+            penalty = taken[addr] * self.taken_penalty
+            if op in sim.BRANCH_OPS:
+                branch_stalls += penalty
+            else:
+                jump_stalls += penalty
+
+            if op in self.load_ops and self.load_use_penalty and addr + 1 < len(code):
+                _, loaded = sim.reg_access(code[addr])
+                used, _ = sim.reg_access(code[addr + 1])
+                if set(loaded) & set(used):
+                    # a load always falls through to the next instruction
+                    stall = (count - taken[addr]) * self.load_use_penalty
+                    load_use_stalls += stall
+                    cycles += stall
+            by_op[str(op)] = by_op.get(str(op), 0) + cycles + penalty
+
+        total = base + branch_stalls + jump_stalls + load_use_stalls
+        return {
+            "instructions": instructions,
+            "cycles": total,
+            "cpi": total / instructions if instructions else 0.0,
+            "stalls": {
+                "taken_branch": branch_stalls,
+                "jump": jump_stalls,
+                "load_use": load_use_stalls,
+            },
+            "cycles_by_op": dict(sorted(by_op.items(), key=lambda item: -item[1])),
+        }
@@ -0,0 +1,32 @@
+#
+# traps.py  --  The protocol between the run loop and its traps.
+#
+# Authors: Mark Liffiton
+#
+# A trap stands in for the instruction at one address, so the run loop can
+# hand that address off to faster code: delay loops (see delay_loops.py) and
+# memoized calls (see call_memo.py) are both traps.  BaseSimulator installs
+# them and runs them in _take_trap().
+#
+from collections.abc import Callable
+
+# What a trap did in place of running instructions one at a time:
+# (new PC, cycles, [(addr, times executed, times taken), ...])
+TrapResult = tuple[int, int, list[tuple[int, int, int]]]
+
+# A trap is called as trap(sim, budget, stops), with the most cycles it may
+# run (None for no limit) and the addresses that must stop the run, and
+# returns a TrapResult, or None to just execute the instruction as usual.  A
+# trap interrupted by an error raises TrapInterrupted, so the run stops where
+# the error happened.  (sim is a simulator_base.BaseSimulator.)
+Trap = Callable[["BaseSimulator", int | None, frozenset[int]], TrapResult | None]
+
+
+class TrapInterrupted(Exception):
+    """ Raised by a trap that hit an error partway through, with what it had
+        done before the error (a TrapResult) and the error itself.
+    """
+    def __init__(self, result: TrapResult, error: Exception) -> None:
+        super().__init__(str(error))
+        self.result = result
+        self.error = error